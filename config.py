@@ -36,3 +36,92 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_METHODS = ["*"]
 # Allowed headers for CORS
 CORS_ALLOWED_HEADERS = ["*"]
+
+# Usernames (web accounts) allowed to use the /admin/api endpoints
+ADMIN_USERNAMES = []
+
+# Login throttling, checked before any password hash is verified.
+# Each username and each client IP gets a bucket of BURST failed attempts that
+# refills one attempt every REFILL_SECONDS. An empty bucket locks the key out,
+# starting at BASE_LOCKOUT_SECONDS and doubling up to MAX_LOCKOUT_SECONDS.
+LOGIN_THROTTLE_USER_BURST = 5
+LOGIN_THROTTLE_USER_REFILL_SECONDS = 60
+LOGIN_THROTTLE_IP_BURST = 20
+LOGIN_THROTTLE_IP_REFILL_SECONDS = 15
+LOGIN_THROTTLE_BASE_LOCKOUT_SECONDS = 30
+LOGIN_THROTTLE_MAX_LOCKOUT_SECONDS = 3600
+# Maximum tracked usernames/IPs each; least recently seen entries are evicted
+LOGIN_THROTTLE_MAX_ENTRIES = 10000
+
+# Load shedding for CPU-heavy routes: (max concurrent, max queued) per class.
+# "login" = Argon2 verify/hash, "signing" = RSA-signed profiles and joins,
+# "image" = PIL skin processing, "web" = page views.
+# When a class's queue is full the request gets 503 with Retry-After.
+# Within "signing", profile lookups may only fill 3/4 of the queue, leaving
+# the rest to hasJoined/join; the other classes use their full queue.
+LOAD_SHED_LIMITS = {
+    "login": (4, 32),
+    "signing": (8, 128),
+    "image": (2, 8),
+    "web": (16, 64),
+}
+# (concurrency, max queue) shared by all classes above. Requests queued here
+# are served by priority across classes: hasJoined/join first (whole queue),
+# then login and profile lookups (3/4 of it), then page views and uploads
+# (half of it).
+LOAD_SHED_GLOBAL_LIMIT = (16, 128)
+# How long a queued request may wait for a slot before it is shed
+LOAD_SHED_MAX_WAIT_SECONDS = 5
+# Retry-After value sent with 503 responses
+LOAD_SHED_RETRY_AFTER_SECONDS = 2
+
+# Profile change event stream ({AUTH_API_PREFIX}/events/profiles)
+# Number of recent events kept so reconnecting clients can resume by id
+EVENTS_HISTORY_SIZE = 1024
+# Events buffered per subscriber; a subscriber that falls this far behind is dropped
+EVENTS_SUBSCRIBER_BUFFER = 256
+# Seconds between keep-alive comments on an idle stream
+EVENTS_HEARTBEAT_SECONDS = 15
+
+# Skin manager avatar sprite sheets: thumbnail edge in pixels and thumbnails per row
+SPRITE_THUMB_SIZE = 64
+SPRITE_COLUMNS = 8
+# Page size of the skin manager page, and default and maximum page size of
+# the /manager/api JSON endpoints
+MANAGER_API_PAGE_SIZE = 50
+MANAGER_API_MAX_PAGE_SIZE = 200
+
+# Signing service for signed profile textures
+# "thread" or "process": where RSA signing runs, off the event loop
+SIGNING_EXECUTOR = "thread"
+SIGNING_WORKERS = 2
+# Signatures requested within SIGNING_BATCH_WINDOW_MS of each other are sent
+# to a worker as one batch of at most SIGNING_BATCH_MAX items
+SIGNING_BATCH_MAX = 32
+SIGNING_BATCH_WINDOW_MS = 2
+# How often workers check whether the key files were rotated on disk
+SIGNING_KEY_CHECK_SECONDS = 5
+
+# Yggdrasil access tokens kept per user; older ones are revoked on login
+MAX_TOKENS_PER_USER = 10
+
+# Background jobs (launcher texture uploads are validated and rendered here)
+JOB_WORKERS = 2
+# Jobs waiting beyond this many make texture uploads return 503
+JOB_QUEUE_SIZE = 256
+# Maximum size of a texture uploaded through the Yggdrasil API, in bytes
+TEXTURE_UPLOAD_MAX_BYTES = 1024 * 1024
+
+# Admin user directory (/admin/api/users, /admin/api/players)
+# Rows per response when no limit is given; limit=0 streams every match
+ADMIN_DIRECTORY_PAGE_SIZE = 100
+# Rows fetched from the database per round trip while streaming a response
+ADMIN_DIRECTORY_CHUNK_SIZE = 500
+
+# Web-UI writes (skin changes, new players, uploads) arriving within
+# WRITE_BATCH_WINDOW_MS of each other share one transaction of at most
+# WRITE_BATCH_MAX writes
+WRITE_BATCH_WINDOW_MS = 5
+WRITE_BATCH_MAX = 64
+# How often per-player last-seen/last-join times are written to the database
+USAGE_FLUSH_SECONDS = 30
@@ -1,39 +1,36 @@
-import base64
+# Imported first so startup timings cover the whole app import
+from pyauthskin import startup
+
 from contextlib import asynccontextmanager
-from pathlib import Path
-import hashlib
+from http import HTTPStatus
 import os
 import secrets
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from fastapi import FastAPI, Request, File, UploadFile, Form, Depends, HTTPException, Response # Add Depends
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from tortoise.contrib.fastapi import register_tortoise
+from tortoise import Tortoise
 from tortoise.exceptions import DoesNotExist, IntegrityError
-from contextlib import asynccontextmanager
-from typing import Optional
-import re # Import regular expressions for password validation
-
-# --- Cryptography imports for key generation ---
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend
-import base64
 
 # --- Import from our new package ---
-from pyauthskin.database import User, Player, Texture
+# PIL, passlib/argon2 and cryptography are imported lazily by the code that
+# needs them (rendering/uploads, first password hash, first signature).
 from pyauthskin.auth_logic import router as auth_router
-from pyauthskin.skins_render import generate_avatar
-from pyauthskin.security import pwd_context
+from pyauthskin.database import ensure_columns, ensure_indexes
 from pyauthskin import keystore
-from pyauthskin.web import router as web_router # Import the new web router
+from pyauthskin.web import router as web_router, templates # Import the new web router
+from pyauthskin.admin import router as admin_router
+from pyauthskin.events import router as events_router
+from pyauthskin.assets import router as assets_router, build_assets
+from pyauthskin.signing import signing_service
+from pyauthskin.texture_api import router as texture_api_router
+from pyauthskin.jobs import job_queue
+from pyauthskin.writes import write_batcher, usage_tracker
 
 # --- Config and Paths ---
-from config import BASE_DIR, DATA_DIR, HOST, PORT, AUTH_API_PREFIX, CORS_ALLOWED_ORIGINS, CORS_ALLOW_CREDENTIALS, CORS_ALLOWED_METHODS, CORS_ALLOWED_HEADERS
+from config import BASE_DIR, DATA_DIR, CORS_ALLOWED_ORIGINS, CORS_ALLOW_CREDENTIALS, CORS_ALLOWED_METHODS, CORS_ALLOWED_HEADERS
+
+startup.mark("imports")
 
 # --- Pre-startup Directory Creation ---
 # Ensure all necessary data directories exist before the app is created.
@@ -41,90 +38,72 @@ from config import BASE_DIR, DATA_DIR, HOST, PORT, AUTH_API_PREFIX, CORS_ALLOWED
 (DATA_DIR / "skins").mkdir(parents=True, exist_ok=True)
 (BASE_DIR / "site").mkdir(parents=True, exist_ok=True) # Ensure site directory exists
 
+# --- RSA Key Generation and Loading ---
+PUBLIC_KEY_PATH = DATA_DIR / "public.pem"
+PRIVATE_KEY_PATH = DATA_DIR / "private.key"
+
+def generate_and_load_keys():
+    # Loading the pair also rebuilds the pre-encoded metadata response (see
+    # auth_logic); the signing workers parse the private key on first use.
+    # Safe to call again.
+    keystore.load_keys(PRIVATE_KEY_PATH, PUBLIC_KEY_PATH)
+
 # --- Lifespan manager for startup events ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Initialize Tortoise ORM
-    from tortoise.contrib.fastapi import register_tortoise
-    register_tortoise(
-        app,
+    startup.mark("server start")
+    # Initialize Tortoise ORM (the only place the database is registered)
+    await Tortoise.init(
         db_url=f"sqlite://{DATA_DIR / 'database.db'}",
         modules={"models": ["pyauthskin.database"]},
-        generate_schemas=True,
-        add_exception_handlers=True,
     )
+    await Tortoise.generate_schemas()
+    await ensure_columns()
+    await ensure_indexes()
+    startup.mark("database")
     generate_and_load_keys()
+    startup.mark("keys")
+    build_assets()
+    startup.mark("assets")
+    # Also resumes uploads that were accepted but not processed before a restart
+    await job_queue.start()
+    usage_tracker.start()
+    startup.print_report()
     yield
+    await job_queue.stop()
+    # Write out pending usage and any queued writes before closing the database
+    await usage_tracker.stop()
+    await write_batcher.drain()
+    signing_service.shutdown()
+    await Tortoise.close_connections()
 
 app = FastAPI(lifespan=lifespan)
 
-# --- RSA Key Generation and Loading ---
-PUBLIC_KEY_PATH = DATA_DIR / "public.pem"
-PRIVATE_KEY_PATH = DATA_DIR / "private.key"
-
-def generate_and_load_keys():
-    # print("Starting key generation/loading...") # debug
-    if not PUBLIC_KEY_PATH.exists() or not PRIVATE_KEY_PATH.exists():
-        print("Generating new RSA key pair...")
-        private_key_obj = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-        public_key_obj = private_key_obj.public_key()
-        with open(PRIVATE_KEY_PATH, "wb") as f:
-            f.write(private_key_obj.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-        with open(PUBLIC_KEY_PATH, "wb") as f:
-            f.write(public_key_obj.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ))
-    
-    # print("Loading existing keys...") # debug
-    with open(PRIVATE_KEY_PATH, "rb") as f:
-        keystore.SIGNING_PRIVATE_KEY = serialization.load_pem_private_key(
-            f.read(), password=None, backend=default_backend()
-        )
-        # print(f"Private key loaded successfully: {keystore.SIGNING_PRIVATE_KEY is not None}") # debug
-    with open(PUBLIC_KEY_PATH, "rb") as f:
-        public_key_pem = f.read()
-        public_key_obj = serialization.load_pem_public_key(public_key_pem, backend=default_backend())
-        # Export public key as PEM (SubjectPublicKeyInfo). authlib-injector expects
-        # a PEM block for signaturePublickey (KeyUtils.decodePEMPublicKey will
-        # remove newlines and parse the inner base64).
-        public_key_pem = public_key_obj.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        keystore.SIGNATURE_PUBLIC_KEY_B64 = public_key_pem.decode('utf-8')
-        # print(f"Public key loaded successfully (PEM), length: {len(keystore.SIGNATURE_PUBLIC_KEY_B64)}")  # debug
-
 # --- Mount static files ---
 app.mount("/skins", StaticFiles(directory=DATA_DIR / "skins"), name="skins")
 
-# --- Initialize Templates and attach to app state ---
-templates = Jinja2Templates(directory=BASE_DIR / "site")
+# --- Share the web router's templates through app state ---
 app.state.templates = templates # Attach templates to app state
 
 # --- Include Routers ---
 app.include_router(auth_router) # For the game client
+app.include_router(texture_api_router)  # Texture upload API for launchers
 app.include_router(web_router)  # For the web interface
+app.include_router(admin_router)  # Admin-only JSON API
+app.include_router(events_router)  # Profile change stream for game servers
+app.include_router(assets_router)  # Hashed, precompressed site assets
 
 # --- Mount site static files after routers ---
 app.mount("/", StaticFiles(directory=BASE_DIR / "site"), name="site")
 
-# --- Database Registration ---
-register_tortoise(
-    app,
-    db_url=f"sqlite://{DATA_DIR / 'database.db'}",
-    modules={"models": ["pyauthskin.database"]},
-    generate_schemas=True,
-    add_exception_handlers=True,
-)
+# --- Tortoise exception handlers (as register_tortoise would add) ---
+@app.exception_handler(DoesNotExist)
+async def doesnotexist_exception_handler(request, exc: DoesNotExist):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+@app.exception_handler(IntegrityError)
+async def integrityerror_exception_handler(request, exc: IntegrityError):
+    return JSONResponse(status_code=422, content={"detail": [{"loc": [], "msg": str(exc), "type": "IntegrityError"}]})
 
 # --- Middleware for Session ---
 from starlette.middleware.sessions import SessionMiddleware # Add SessionMiddleware
@@ -132,21 +111,6 @@ from starlette.exceptions import HTTPException as StarletteHTTPException # Impor
 from starlette.requests import Request as StarletteRequest # Explicitly import Request for the handler
 from starlette.middleware.cors import CORSMiddleware
 
-# --- CSRF Protection ---
-from fastapi_csrf_protect import CsrfProtect
-from fastapi_csrf_protect.exceptions import CsrfProtectError
-
-# --- Rate Limiting ---
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
-
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
-
 # Get session secret from env or generate random
 SESSION_SECRET = os.getenv("SESSION_SECRET", secrets.token_hex(32))
 
@@ -176,6 +140,12 @@ async def http_exception_handler(request: StarletteRequest, exc: StarletteHTTPEx
     elif exc.status_code == 405:
         # Handle 405 Method Not Allowed
         return JSONResponse(status_code=405, content={"error": "Method Not Allowed", "errorMessage": exc.detail})
+    elif exc.status_code == 429:
+        # Login throttling; keep the Retry-After header
+        return JSONResponse(status_code=429, content={"error": "Too Many Requests", "errorMessage": exc.detail}, headers=exc.headers)
+    elif exc.status_code == 503:
+        # Load shedding; keep the Retry-After header
+        return JSONResponse(status_code=503, content={"error": "Service Unavailable", "errorMessage": exc.detail}, headers=exc.headers)
     # For other HTTP exceptions, re-raise to let default handler take over
     raise exc
 
@@ -188,55 +158,23 @@ async def fastapi_http_exception_handler(request: StarletteRequest, exc: HTTPExc
     elif exc.status_code == 405:
         # Handle 405 Method Not Allowed
         return JSONResponse(status_code=405, content={"error": "Method Not Allowed", "errorMessage": exc.detail})
-    # For other HTTP exceptions, re-raise to let default handler take over
-    raise exc
+    elif exc.status_code == 429:
+        # Login throttling; keep the Retry-After header
+        return JSONResponse(status_code=429, content={"error": "Too Many Requests", "errorMessage": exc.detail}, headers=exc.headers)
+    elif exc.status_code == 503:
+        # Load shedding; keep the Retry-After header
+        return JSONResponse(status_code=503, content={"error": "Service Unavailable", "errorMessage": exc.detail}, headers=exc.headers)
+    elif exc.status_code == 204:
+        return Response(status_code=204)
+    # Re-raising from a handler would turn the error into a 500, so answer
+    # every other status in the same error format
+    return JSONResponse(status_code=exc.status_code, content={"error": HTTPStatus(exc.status_code).phrase, "errorMessage": exc.detail}, headers=exc.headers)
+
 
 
+startup.mark("app setup")
+
 if __name__ == "__main__":
     import uvicorn
     from config import HOST, PORT, LOG_LEVEL # Import LOG_LEVEL
     uvicorn.run("main:app", host=HOST, port=PORT, reload=True, log_level=LOG_LEVEL) # Set log_level
-
-# --- Web UI Endpoints (moved to pyauthskin/web.py) ---
-@app.get("/manager")
-async def manager(request: Request):
-    user = request.session.get("user")
-    if not user:
-        return RedirectResponse(url="/login", status_code=303)
-    
-    user = await User.get(id=user["id"])
-    textures = await UserTexture.filter(user=user)
-    return request.app.state.templates.TemplateResponse("manager.html", {"request": request, "user": user, "textures": textures})
-
-@app.post("/manager/upload")
-async def upload_skin(request: Request, file: UploadFile = File(...), display_name: str = Form(...), model: str = Form(...)):
-    user = request.session.get("user")
-    if not user:
-        return JSONResponse({"error": "Unauthorized"}, status_code=401)
-    
-    user = await User.get(id=user["id"])
-    file_location = DATA_DIR / "skins" / file.filename
-
-    # Save the uploaded file to the designated location
-    with open(file_location, "wb") as f:
-        content = await file.read()
-        f.write(content)
-
-    # Create or update the texture record in the database
-    texture, created = await Texture.get_or_create(
-        name=display_name,
-        defaults={"file_path": str(file_location)}
-    )
-    if not created:
-        # If the texture already exists, update the file path
-        texture.file_path = str(file_location)
-        await texture.save()
-
-    # Deactivate other skins for the user
-    await UserTexture.filter(user=user, is_active_skin=True).update(is_active_skin=False)
-    await UserTexture.create(user=user, texture=texture, display_name=display_name, model=model, is_active_skin=True)
-
-    # Pass the actual skin dimensions to generate_avatar
-    generate_avatar(skin_path, avatar_path, width=skin_width, height=skin_height)
-
-    return RedirectResponse(url="/manager", status_code=303)
@@ -0,0 +1,232 @@
+# pyauthskin/admin.py
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from tortoise import Tortoise
+from tortoise.expressions import Q
+
+from config import ADMIN_USERNAMES, ADMIN_DIRECTORY_PAGE_SIZE, ADMIN_DIRECTORY_CHUNK_SIZE
+from .database import User, Player, Texture
+from .events import event_bus
+from .jobs import job_queue
+from .writes import write_batcher, usage_tracker
+from . import keystore
+from .loadshed import limiters, global_limiter
+from .signing import signing_service
+from . import startup
+from .throttle import login_throttle
+from .web import get_current_user
+
+# Admin-only JSON API, authenticated by the normal web session
+router = APIRouter(prefix="/admin/api", tags=["Admin"])
+
+async def require_admin(user: User = Depends(get_current_user)) -> User:
+    if not user or user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+@router.get("/throttle")
+async def throttle_state(admin: User = Depends(require_admin)):
+    """Login throttle counters and current lockouts."""
+    return login_throttle.snapshot()
+
+@router.delete("/throttle/{kind}/{key}")
+async def throttle_reset(kind: str, key: str, admin: User = Depends(require_admin)):
+    """Clears the bucket for a username or IP, lifting any lockout."""
+    if kind not in ("user", "ip"):
+        raise HTTPException(status_code=404, detail="Unknown throttle kind")
+    return {"removed": login_throttle.reset(kind, key.lower() if kind == "user" else key)}
+
+@router.get("/load")
+async def load_state(admin: User = Depends(require_admin)):
+    """Active, queued and shed request counts per load-shedding class."""
+    return {"global": global_limiter.snapshot(),
+            **{name: limiter.snapshot() for name, limiter in limiters.items()}}
+
+@router.get("/jobs")
+async def jobs_state(admin: User = Depends(require_admin)):
+    """Background job queue depth and outcome counters."""
+    return job_queue.snapshot()
+
+@router.get("/writes")
+async def writes_state(admin: User = Depends(require_admin)):
+    """Write batching counters and usage timestamps awaiting a flush."""
+    return {"batcher": write_batcher.snapshot(), "usage": usage_tracker.snapshot()}
+
+@router.get("/events")
+async def events_state(admin: User = Depends(require_admin)):
+    """Profile event stream subscribers and counters."""
+    return event_bus.snapshot()
+
+@router.get("/startup")
+async def startup_timings(admin: User = Depends(require_admin)):
+    """How long this worker took to import and start, by phase."""
+    return startup.report()
+
+@router.get("/keys")
+async def keys_state(admin: User = Depends(require_admin)):
+    """Active signing key and signing service counters."""
+    key_pair = keystore.current_key_pair()
+    return {
+        "generation": key_pair.generation if key_pair else None,
+        "public_key_sha256": hashlib.sha256(key_pair.public_pem.encode("utf-8")).hexdigest() if key_pair else None,
+        "signing": signing_service.snapshot(),
+    }
+
+@router.post("/keys/rotate")
+async def keys_rotate(generate: bool = True, admin: User = Depends(require_admin)):
+    """Generates (or, with generate=false, reloads from disk) the signing key pair.
+
+    Takes effect immediately in this worker and within SIGNING_KEY_CHECK_SECONDS
+    in the others; the metadata endpoint serves the new public key right away.
+    """
+    key_pair = await run_in_threadpool(keystore.rotate_keys, generate)
+    return {
+        "generation": key_pair.generation,
+        "public_key_sha256": hashlib.sha256(key_pair.public_pem.encode("utf-8")).hexdigest(),
+    }
+
+# --- User directory ---
+# Listings are ordered by id; searches (q=) are case-insensitive name
+# prefix matches ordered by (name, id) and served from the NOCASE indexes
+# created by ensure_indexes(). Both use keyset pagination: the response's
+# `next_after` is passed back as `after`. Rows are fetched in chunks and
+# written out as they arrive, so even limit=0 (everything) runs in
+# constant memory.
+
+_USER_COLUMNS = 'u."id", u."username"'
+_PLAYER_COLUMNS = ('p."id", p."uuid", p."name", p."user_id", u."username", '
+                   'p."skin_texture_id", p."cape_texture_id", '
+                   'p."last_seen_at", p."last_join_at", p."join_count"')
+_PLAYER_FROM = '"player" p JOIN "user" u ON u."id" = p."user_id"'
+
+def _prefix_bounds(q: str):
+    # NOCASE only folds ASCII letters, so fold the same way before building
+    # the exclusive upper bound of the prefix range
+    low = "".join(c.lower() if "A" <= c <= "Z" else c for c in q)
+    return low, low[:-1] + chr(ord(low[-1]) + 1)
+
+def _parse_cursor(after: Optional[str]):
+    """`after` is "<id>" for listings and "<id>:<name>" for searches."""
+    if not after:
+        return 0, ""
+    id_part, _, name = after.partition(":")
+    try:
+        return int(id_part), name
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _format_cursor(key) -> str:
+    last_id, name = key
+    return f"{last_id}:{name}" if name else str(last_id)
+
+def _directory_query(columns: str, source: str, name_column: str, q: Optional[str]):
+    """Returns fetch(cursor, n) for a listing or a prefix search, and key_of(row).
+
+    Cursors are (last id, last name); the name is only used by searches.
+    """
+    conn = Tortoise.get_connection("default")
+    alias, name_key = name_column.split(".")
+    name_key = name_key.strip('"')
+    if not q:
+        sql = f'SELECT {columns} FROM {source} WHERE {alias}."id" > ? ORDER BY {alias}."id" LIMIT ?'
+
+        async def fetch(cursor, n):
+            return await conn.execute_query_dict(sql, [cursor[0], n])
+        return fetch, lambda row: (row["id"], "")
+
+    low, high = _prefix_bounds(q)
+    sql = (f'SELECT {columns} FROM {source} '
+           f'WHERE {name_column} >= ? COLLATE NOCASE AND {name_column} < ? COLLATE NOCASE '
+           f'AND ({name_column} COLLATE NOCASE, {alias}."id") > (?, ?) '
+           f'ORDER BY {name_column} COLLATE NOCASE, {alias}."id" LIMIT ?')
+
+    async def fetch(cursor, n):
+        last_id, last_name = cursor
+        # Start the index range at the cursor rather than the prefix, so
+        # deep pages cost the same as the first
+        start = last_name if last_name.lower() > low else low
+        return await conn.execute_query_dict(sql, [start, high, last_name, last_id, n])
+    return fetch, lambda row: (row["id"], row[name_key])
+
+# Raw SQL returns SQLite's "YYYY-MM-DD HH:MM:SS" text for datetime columns;
+# re-emit them in the ISO form the ORM-backed endpoints return
+_TIMESTAMP_COLUMNS = ("last_seen_at", "last_join_at")
+
+def _row_json(row) -> str:
+    row = dict(row)
+    for column in _TIMESTAMP_COLUMNS:
+        if isinstance(row.get(column), str):
+            row[column] = datetime.fromisoformat(row[column]).isoformat()
+    return json.dumps(row, ensure_ascii=False)
+
+async def _stream_directory(fetch, key_of, cursor, limit: int):
+    """Yields `{"items": [...], "next_after": ...}` chunk by chunk."""
+    yield b'{"items":['
+    sent = 0
+    next_after = None
+    while True:
+        want = ADMIN_DIRECTORY_CHUNK_SIZE if limit == 0 else min(ADMIN_DIRECTORY_CHUNK_SIZE, limit - sent)
+        rows = await fetch(cursor, want + 1)
+        page = rows[:want]
+        if page:
+            body = ",".join(_row_json(row) for row in page)
+            yield ((b"," if sent else b"") + body.encode("utf-8"))
+            sent += len(page)
+            cursor = key_of(page[-1])
+        if len(rows) <= want:
+            break
+        if limit and sent >= limit:
+            next_after = _format_cursor(cursor)
+            break
+    yield b'],"next_after":' + json.dumps(next_after, ensure_ascii=False).encode("utf-8") + b'}'
+
+def _directory_response(columns, source, name_column, q, after, limit):
+    limit = ADMIN_DIRECTORY_PAGE_SIZE if limit is None else max(0, limit)
+    fetch, key_of = _directory_query(columns, source, name_column, q)
+    return StreamingResponse(_stream_directory(fetch, key_of, _parse_cursor(after), limit), media_type="application/json")
+
+@router.get("/users")
+async def directory_users(q: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None,
+                          admin: User = Depends(require_admin)):
+    """Web accounts, optionally filtered by case-insensitive username prefix `q`. limit=0 returns all."""
+    return _directory_response(_USER_COLUMNS, '"user" u', 'u."username"', q, after, limit)
+
+@router.get("/players")
+async def directory_players(q: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None,
+                            admin: User = Depends(require_admin)):
+    """Players with their owning account, optionally filtered by case-insensitive name prefix `q`. limit=0 returns all."""
+    return _directory_response(_PLAYER_COLUMNS, _PLAYER_FROM, 'p."name"', q, after, limit)
+
+@router.get("/players/{uuid}")
+async def directory_player(uuid: str, admin: User = Depends(require_admin)):
+    """Looks up a player (and the account owning it) by UUID, with or without dashes."""
+    player = await Player.filter(uuid=uuid.replace("-", "").lower()).values(
+        "id", "uuid", "name", "user_id", "user__username", "skin_texture_id", "cape_texture_id",
+        "last_seen_at", "last_join_at", "join_count")
+    if not player:
+        raise HTTPException(status_code=404, detail="Player not found")
+    row = player[0]
+    row["username"] = row.pop("user__username")
+    return row
+
+@router.get("/textures/{texture_hash}")
+async def directory_texture(texture_hash: str, admin: User = Depends(require_admin)):
+    """Every texture record for a file hash, with its uploader and the players using it."""
+    textures = await Texture.filter(hash=texture_hash.lower()).order_by("id").values(
+        "id", "hash", "type", "model", "width", "height", "display_name", "uploader_id", "uploader__username")
+    if not textures:
+        raise HTTPException(status_code=404, detail="Texture not found")
+    ids = [t["id"] for t in textures]
+    players = await Player.filter(Q(skin_texture_id__in=ids) | Q(cape_texture_id__in=ids)).order_by("id").values(
+        "id", "uuid", "name", "skin_texture_id", "cape_texture_id")
+    for t in textures:
+        t["uploader"] = t.pop("uploader__username")
+        t["players"] = [p for p in players if t["id"] in (p["skin_texture_id"], p["cape_texture_id"])]
+    return textures
@@ -0,0 +1,102 @@
+# pyauthskin/assets.py
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+from fastapi import APIRouter, Request, Response
+
+from config import BASE_DIR
+
+# Brotli is optional; without it text assets are only precompressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+router = APIRouter(prefix="/static", tags=["Assets"])
+
+SITE_DIR = BASE_DIR / "site"
+# Templates are rendered by Jinja, not served as assets
+_SKIP_SUFFIXES = {".html"}
+_TEXT_SUFFIXES = {".css", ".js", ".svg", ".json", ".txt"}
+
+
+class Asset:
+    __slots__ = ("name", "hashed_name", "media_type", "digest", "bodies")
+
+    def __init__(self, path: Path):
+        raw = path.read_bytes()
+        digest = hashlib.sha256(raw).hexdigest()[:12]
+        self.name = path.name
+        self.hashed_name = f"{path.stem}.{digest}{path.suffix}"
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.digest = digest
+        # Encoded bodies, most preferred first
+        self.bodies = {}
+        if path.suffix in _TEXT_SUFFIXES:
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(raw, quality=11)
+            self.bodies["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+        self.bodies["identity"] = raw
+
+
+# name -> Asset and hashed name -> Asset, filled by build_assets()
+_assets = {}
+_by_hashed_name = {}
+
+
+def build_assets(site_dir: Path = SITE_DIR) -> None:
+    """Hashes and precompresses every static file under site/ once at startup."""
+    _assets.clear()
+    _by_hashed_name.clear()
+    for path in sorted(site_dir.iterdir()):
+        if not path.is_file() or path.suffix in _SKIP_SUFFIXES:
+            continue
+        asset = Asset(path)
+        _assets[asset.name] = asset
+        _by_hashed_name[asset.hashed_name] = asset
+
+
+def asset_url(name: str) -> str:
+    """Template helper: content-hashed URL for a site asset."""
+    asset = _assets.get(name)
+    if asset is None:
+        # Not built (or unknown); fall back to the plain site mount
+        return f"/{name}"
+    return f"/static/{asset.hashed_name}"
+
+
+def _accepted_encodings(request: Request) -> set:
+    header = request.headers.get("accept-encoding", "")
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+@router.get("/{filename}")
+async def static_asset(filename: str, request: Request):
+    asset = _by_hashed_name.get(filename)
+    if asset is None:
+        return Response(status_code=404)
+
+    accepted = _accepted_encodings(request)
+    encoding = next(e for e in asset.bodies if e == "identity" or e in accepted)
+    # Each encoding is a different representation, so it gets its own
+    # strong validator
+    etag = f'"{asset.digest}"' if encoding == "identity" else f'"{asset.digest}-{encoding}"'
+    headers = {
+        # The URL changes whenever the content does, so it can be cached forever
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=asset.bodies[encoding], media_type=asset.media_type, headers=headers)
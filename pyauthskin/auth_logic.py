@@ -1,14 +1,20 @@
 import base64
+import hashlib
 import time
 import json
-from fastapi import APIRouter, HTTPException, Body, Query, Response
+from fastapi import APIRouter, HTTPException, Body, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from .database import User, Player, Texture
 from config import BASE_URL # Changed to absolute import
 from .security import pwd_context
-from typing import Dict, Any
+from .throttle import login_throttle
+from .tokens import issue_token, get_token
+from .loadshed import shed, PRIORITY_HIGH
+from typing import Dict, Any, Optional
+from tortoise.exceptions import DoesNotExist
 from . import keystore
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+from .signing import signing_service
+from .writes import usage_tracker
 from config import HOST, AUTH_API_PREFIX
 from pathlib import Path
 
@@ -16,99 +22,137 @@ from pathlib import Path
 router = APIRouter(prefix=AUTH_API_PREFIX, tags=["Yggdrasil"])
 
 # --- Yggdrasil Metadata Endpoint ---
-# This must match the AUTH_API_PREFIX exactly, without a trailing slash.
-@router.get("")
-async def yggdrasil_meta():
-    """Yggdrasil metadata endpoint."""
-    return {
+# The response only changes when the key pair does, so it is serialized once
+# by refresh_meta() (called after the keys are loaded) and served as bytes.
+_META_BODY = b""
+_META_ETAG = ""
+
+def refresh_meta():
+    """Rebuilds the pre-encoded metadata response from the loaded public key."""
+    global _META_BODY, _META_ETAG
+    meta = {
         "meta": {
             "serverName": "PyAuthSkin",
             "implementationName": "PyAuthSkin",
             "implementationVersion": "1.0.0"
         },
         # Include common local loopback domains to avoid client-side rejection
-        # when using localhost vs 127.0.0.1 as the skin host.
-        "skinDomains": list({HOST, "127.0.0.1", "localhost"}),
+        # when using localhost vs 127.0.0.1 as the skin host. Sorted so the
+        # body (and its ETag) is identical across workers.
+        "skinDomains": sorted({HOST, "127.0.0.1", "localhost"}),
         "signaturePublickey": keystore.SIGNATURE_PUBLIC_KEY_B64
     }
+    body = json.dumps(meta, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    _META_ETAG = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+    _META_BODY = body
+
+# Rebuild the metadata whenever a key pair is loaded or rotated
+keystore.add_listener(lambda key_pair: refresh_meta())
 
-def sign_data(data: bytes) -> bytes:
+# This must match the AUTH_API_PREFIX exactly, without a trailing slash.
+@router.get("")
+async def yggdrasil_meta(request: Request):
+    """Yggdrasil metadata endpoint."""
+    # Pick up keys rotated by another worker (the listener rebuilds the body)
+    keystore.reload_if_changed()
+    if not _META_BODY:
+        refresh_meta()
+    headers = {"ETag": _META_ETAG, "Cache-Control": "no-cache"}
+    if _META_ETAG in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=_META_BODY, media_type="application/json", headers=headers)
+
+async def sign_data(data: bytes) -> bytes:
     """Signs the given data with the server's private key."""
-    # print(f"Debug: SIGNING_PRIVATE_KEY is None: {keystore.SIGNING_PRIVATE_KEY is None}")
-    if not keystore.SIGNING_PRIVATE_KEY:
-        raise RuntimeError("Server private key not loaded.")
-    
-    return keystore.SIGNING_PRIVATE_KEY.sign(
-        data,
-        padding.PKCS1v15(),
-        hashes.SHA1()
-    )
+    # RSA runs on the signing service's pool, batched with concurrent requests
+    return await signing_service.sign(data)
+
+# Everything a signed profile needs, fetched in one query: values() with
+# related fields LEFT JOINs the skin and cape textures instead of running a
+# prefetch query for each.
+_PROFILE_FIELDS = ("uuid", "name", "skin_texture__path", "skin_texture__model", "cape_texture__path")
+
+async def resolve_profile(**filters) -> Optional[dict]:
+    """Returns the player row (with texture columns) matching `filters`, or None."""
+    rows = await Player.filter(**filters).limit(1).values(*_PROFILE_FIELDS)
+    return rows[0] if rows else None
+
+def texture_url(texture_path: str) -> str:
+    # Use the actual file stem (from texture.path) so the client requests
+    # the real physical file name on disk.
+    return f"{BASE_URL}/skins/{Path(texture_path).stem}.png"
 
 async def get_player_profile_data(uuid: str):
     try:
         # Ensure the UUID format is consistent (no hyphens)
         clean_uuid = uuid.replace('-', '')
-        player = await Player.get(uuid=clean_uuid).prefetch_related('skin_texture')
-        
-        textures_data = {}
-        if player.skin_texture:
-            skin_model = player.skin_texture.model
-            skin_metadata = {}
-            if skin_model == 'slim':
-                skin_metadata['model'] = 'slim'
-
-            textures_data["SKIN"] = {
-                # Use the actual file stem (from texture.path) so the
-                # client requests the real physical file name on disk.
-                "url": f"{BASE_URL}/skins/{Path(player.skin_texture.path).stem}.png",
-                "metadata": skin_metadata
-            }
+        player = await resolve_profile(uuid=clean_uuid)
+        if player is None:
+            raise DoesNotExist(f"No player with uuid {clean_uuid}")
+        return await build_profile_response(player)
+    except Exception as e:
+        print(f"Error getting player profile: {e}") # Added for debugging
+        raise HTTPException(status_code=404, detail="User not found")
 
-        # The value of the "textures" property must be a signed JSON string
-        # Normalize stored UUID (which may be stored without hyphens) into
-        # hyphenated form for the signed JSON's profileId.
-        u = player.uuid
-        if len(u) == 32 and '-' not in u:
-            hyphen_uuid = f"{u[0:8]}-{u[8:12]}-{u[12:16]}-{u[16:20]}-{u[20:32]}"
-        else:
-            hyphen_uuid = u
+async def build_profile_response(player: dict):
+    """Builds the signed Yggdrasil profile for a row from resolve_profile()."""
+    textures_data = {}
+    if player["skin_texture__path"]:
+        skin_metadata = {}
+        if player["skin_texture__model"] == 'slim':
+            skin_metadata['model'] = 'slim'
 
-        profile_textures = {
-            "timestamp": int(time.time() * 1000),
-            # Use hyphenated UUID in the signed textures JSON to match client
-            # expectations.
-            "profileId": hyphen_uuid,
-            "profileName": player.name,
-            "textures": textures_data
+        textures_data["SKIN"] = {
+            "url": texture_url(player["skin_texture__path"]),
+            "metadata": skin_metadata
+        }
+    if player["cape_texture__path"]:
+        textures_data["CAPE"] = {
+            "url": texture_url(player["cape_texture__path"])
         }
 
-        # To ensure canonical representation, dump the JSON without any whitespace
-        # and preserve non-ASCII characters (avoid \uXXXX escapes).
-        textures_json = json.dumps(profile_textures, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    # The value of the "textures" property must be a signed JSON string
+    # Normalize stored UUID (which may be stored without hyphens) into
+    # hyphenated form for the signed JSON's profileId.
+    u = player["uuid"]
+    if len(u) == 32 and '-' not in u:
+        hyphen_uuid = f"{u[0:8]}-{u[8:12]}-{u[12:16]}-{u[16:20]}-{u[20:32]}"
+    else:
+        hyphen_uuid = u
 
-        # The Yggdrasil property 'value' is the base64 of the JSON. Some
-        # verification paths operate on the raw JSON bytes while others may
-        # verify against the base64-encoded string bytes. To maximize
-        # compatibility, sign the base64-encoded value bytes (this matches the
-        # behavior of several reference implementations).
-        value_b64 = base64.b64encode(textures_json).decode('utf-8')
-        signature = sign_data(value_b64.encode('utf-8'))
+    profile_textures = {
+        "timestamp": int(time.time() * 1000),
+        # Use hyphenated UUID in the signed textures JSON to match client
+        # expectations.
+        "profileId": hyphen_uuid,
+        "profileName": player["name"],
+        "textures": textures_data
+    }
 
-        return {
-            "id": player.uuid.replace('-', ''),  # Use unsigned UUID
-            "name": player.name,
-            "properties": [{
-                "name": "textures",
-                "value": value_b64,
-                "signature": base64.b64encode(signature).decode('utf-8')
-            }]
-        }
-    except Exception as e:
-        print(f"Error getting player profile: {e}") # Added for debugging
-        raise HTTPException(status_code=404, detail="User not found")
+    # To ensure canonical representation, dump the JSON without any whitespace
+    # and preserve non-ASCII characters (avoid \uXXXX escapes).
+    textures_json = json.dumps(profile_textures, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
 
-@router.post("/authserver/authenticate")
-async def authenticate(data: Dict[str, Any] = Body(...)):
+    # The Yggdrasil property 'value' is the base64 of the JSON. Some
+    # verification paths operate on the raw JSON bytes while others may
+    # verify against the base64-encoded string bytes. To maximize
+    # compatibility, sign the base64-encoded value bytes (this matches the
+    # behavior of several reference implementations).
+    value_b64 = base64.b64encode(textures_json).decode('utf-8')
+    signature = await sign_data(value_b64.encode('utf-8'))
+
+    return {
+        "id": player["uuid"].replace('-', ''),  # Use unsigned UUID
+        "name": player["name"],
+        "properties": [{
+            "name": "textures",
+            "value": value_b64,
+            "signature": base64.b64encode(signature).decode('utf-8')
+        }]
+    }
+
+@router.post("/authserver/authenticate", dependencies=[shed("login")])
+async def authenticate(request: Request, data: Dict[str, Any] = Body(...)):
     login_username = data.get("username")
     password = data.get("password")
 
@@ -120,49 +164,67 @@ async def authenticate(data: Dict[str, Any] = Body(...)):
     if db_username.endswith("@test.com"):
         db_username = db_username[:-len("@test.com")]
 
+    # Reject throttled usernames/IPs before paying for an Argon2 verify
+    client_ip = request.client.host if request.client else None
+    retry_after = login_throttle.check(db_username, client_ip)
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many failed login attempts",
+                            headers={"Retry-After": str(int(retry_after) + 1)})
+
+    # Only a wrong username or password counts against the throttle; other
+    # errors (e.g. a busy database) propagate instead of locking users out
     try:
         user = await User.get(username=db_username)
-        if not pwd_context.verify(password, user.password):
-            raise HTTPException(status_code=403, detail="Invalid credentials")
-        
-        # Get all players for the user
-        players = await Player.filter(user=user)
-        # Format UUIDs without hyphens for Minecraft client (authlib-injector expects unsigned UUIDs)
-        available_profiles = [{"id": p.uuid.replace('-', ''), "name": p.name} for p in players]
-        
-        # Select the first profile as selectedProfile
-        selected_profile = available_profiles[0] if available_profiles else None
-        
-        return {
-            "accessToken": "fake-token-for-now",
-            "clientToken": data.get("clientToken"),
-            "availableProfiles": available_profiles,
-            "selectedProfile": selected_profile,
-            "user": {
-                "id": user.id,  # User id, not uuid
-                "properties": []
-            }
-        }
-    except Exception:
+    except DoesNotExist:
+        login_throttle.record_failure(db_username, client_ip)
+        raise HTTPException(status_code=403, detail="Invalid credentials")
+    # Argon2 releases the GIL, so verify off the event loop
+    if not await run_in_threadpool(pwd_context.verify, password, user.password):
+        login_throttle.record_failure(db_username, client_ip)
         raise HTTPException(status_code=403, detail="Invalid credentials")
+    login_throttle.record_success(db_username)
+
+    # Get all players for the user
+    players = await Player.filter(user=user)
+    # Format UUIDs without hyphens for Minecraft client (authlib-injector expects unsigned UUIDs)
+    available_profiles = [{"id": p.uuid.replace('-', ''), "name": p.name} for p in players]
+
+    # Select the first profile as selectedProfile
+    selected_profile = available_profiles[0] if available_profiles else None
+
+    token = await issue_token(user, data.get("clientToken"))
+    return {
+        "accessToken": token.access_token,
+        "clientToken": token.client_token,
+        "availableProfiles": available_profiles,
+        "selectedProfile": selected_profile,
+        "user": {
+            "id": user.id,  # User id, not uuid
+            "properties": []
+        }
+    }
 
 # Correct the session server path
-@router.get("/sessionserver/session/minecraft/profile/{uuid}")
+@router.get("/sessionserver/session/minecraft/profile/{uuid}", dependencies=[shed("signing")])
 async def get_profile(uuid: str):
     return await get_player_profile_data(uuid)
 
-@router.get("/sessionserver/session/minecraft/hasJoined")
+# hasJoined and join let players into servers, so they jump the queue
+@router.get("/sessionserver/session/minecraft/hasJoined", dependencies=[shed("signing", PRIORITY_HIGH)])
 async def has_joined(username: str = Query(...), serverId: str = Query(...), ip: str = Query(None)):
     """Check if a player has joined the server."""
     try:
-        # Find player by username
-        player = await Player.get(name=username).prefetch_related('skin_texture')
+        # Find player by username, textures included
+        player = await resolve_profile(name=username)
+        if player is None:
+            raise DoesNotExist(f"No player named {username}")
         
         # For now, we don't validate serverId since we don't implement join
         # In a full implementation, you'd check if the player joined with this serverId
+        usage_tracker.seen(player["uuid"])
         
         # Return the profile data
-        return await get_player_profile_data(player.uuid)
+        return await build_profile_response(player)
     except Exception as e:
         print(f"hasJoined error for {username}: {e}")
         # If player not found or any error, return 204 No Content
@@ -172,8 +234,9 @@ async def has_joined(username: str = Query(...), serverId: str = Query(...), ip:
 async def has_joined_head(username: str = Query(...), serverId: str = Query(...), ip: str = Query(None)):
     """HEAD version of hasJoined."""
     try:
-        # Find player by username
-        player = await Player.get(name=username).prefetch_related('skin_texture')
+        # Find player by username; no textures needed for HEAD
+        if not await Player.filter(name=username).exists():
+            raise DoesNotExist(f"No player named {username}")
         
         # Return 200 OK with no body
         return Response(status_code=200)
@@ -182,7 +245,7 @@ async def has_joined_head(username: str = Query(...), serverId: str = Query(...)
         # If player not found or any error, return 204 No Content
         raise HTTPException(status_code=204)
 
-@router.post("/sessionserver/session/minecraft/join")
+@router.post("/sessionserver/session/minecraft/join", dependencies=[shed("signing", PRIORITY_HIGH)])
 async def join_server(data: Dict[str, Any] = Body(...)):
     """Record that a player has joined a server."""
     access_token = data.get("accessToken")
@@ -194,9 +257,8 @@ async def join_server(data: Dict[str, Any] = Body(...)):
     if not selected_profile:
         raise HTTPException(status_code=400, detail="selectedProfile is required")
     
-    # For now, we don't validate the access token thoroughly
-    # In a real implementation, you'd validate the token and check permissions
-    if access_token != "fake-token-for-now" and access_token != "refreshed-fake-token":
+    token = await get_token(access_token)
+    if token is None:
         raise HTTPException(status_code=403, detail="Invalid access token")
     
     # Handle different formats of selectedProfile
@@ -214,11 +276,13 @@ async def join_server(data: Dict[str, Any] = Body(...)):
     try:
         # Remove hyphens from UUID if present
         clean_uuid = profile_uuid.replace('-', '')
-        player = await Player.get(uuid=clean_uuid)
+        # The profile must belong to the token's user
+        player = await Player.get(uuid=clean_uuid, user_id=token.user_id)
         
         # In a full implementation, you'd store this join session
-        # For now, just validate that the player exists
-        print(f"Player {player.name} joined server with UUID {player.uuid}")
+        # For now, just validate that the player exists and count the join
+        # (timestamps are written in batches, not per join)
+        usage_tracker.joined(player.uuid)
         
         # Return empty response (204 No Content is typical for join)
         return Response(status_code=204)
@@ -236,15 +300,12 @@ async def refresh(data: Dict[str, Any] = Body(...)):
     if not access_token:
         raise HTTPException(status_code=400, detail="accessToken is required")
     
-    # For now, we assume the user is authenticated via access token
-    # In a real implementation, you'd validate the access token
-    # For simplicity, we'll just return the selected profile if provided
-    
-    response = {
-        "accessToken": "refreshed-fake-token",
-        "clientToken": data.get("clientToken")
-    }
+    # Refreshing swaps the token for a new one bound to the same client
+    old_token = await get_token(access_token, data.get("clientToken"))
+    if old_token is None:
+        raise HTTPException(status_code=403, detail="Invalid token")
     
+    selected_profile = None
     if selected_profile_data:
         # Validate that the selected profile exists and belongs to the user
         profile_uuid = selected_profile_data.get("id")
@@ -253,10 +314,9 @@ async def refresh(data: Dict[str, Any] = Body(...)):
         try:
             # Remove hyphens from UUID if present, then search in database
             clean_uuid = profile_uuid.replace('-', '')
-            # For now, just check if the profile exists
-            player = await Player.get(uuid=clean_uuid)
+            player = await Player.get(uuid=clean_uuid, user_id=old_token.user_id)
             # Return UUID without hyphens for consistency with authlib-injector
-            response["selectedProfile"] = {
+            selected_profile = {
                 "id": player.uuid.replace('-', ''),
                 "name": player.name
             }
@@ -264,4 +324,13 @@ async def refresh(data: Dict[str, Any] = Body(...)):
             print(f"Error validating profile {profile_name} with UUID {profile_uuid}: {e}")
             raise HTTPException(status_code=400, detail=f"Invalid profile: {profile_name}")
     
-    return response
\ No newline at end of file
+    new_token = await issue_token(await old_token.user, old_token.client_token)
+    await old_token.delete()
+    response = {
+        "accessToken": new_token.access_token,
+        "clientToken": new_token.client_token
+    }
+    if selected_profile:
+        response["selectedProfile"] = selected_profile
+    
+    return response
@@ -1,4 +1,5 @@
 import tortoise
+from tortoise import Tortoise
 from tortoise.models import Model
 from tortoise import fields
 
@@ -14,6 +15,10 @@ class Player(Model):
     uuid = fields.CharField(max_length=255, unique=True)
     skin_texture = fields.ForeignKeyField('models.Texture', related_name='skin_players', null=True)
     cape_texture = fields.ForeignKeyField('models.Texture', related_name='cape_players', null=True)
+    # Usage, written in batches by writes.usage_tracker
+    last_seen_at = fields.DatetimeField(null=True)
+    last_join_at = fields.DatetimeField(null=True)
+    join_count = fields.IntField(default=0)
 
 class Texture(Model):
     id = fields.IntField(pk=True)
@@ -27,4 +32,51 @@ class Texture(Model):
     width = fields.IntField(default=64)
     height = fields.IntField(default=64)
     display_name = fields.CharField(max_length=255, default="")
-    model = fields.CharField(max_length=10, default="classic")  # classic or slim
\ No newline at end of file
+    model = fields.CharField(max_length=10, default="classic")  # classic or slim
+    type = fields.CharField(max_length=10, default="skin")  # skin or cape
+
+class Token(Model):
+    id = fields.IntField(pk=True)
+    access_token = fields.CharField(max_length=64, unique=True)
+    client_token = fields.CharField(max_length=255, default="")
+    user = fields.ForeignKeyField('models.User', related_name='tokens')
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+# Columns added after tables may already exist. generate_schemas() only
+# creates missing tables, so ensure_columns() adds these to older databases.
+_ADDED_COLUMNS = {
+    "texture": [("type", "VARCHAR(10) NOT NULL DEFAULT 'skin'")],
+    "player": [
+        ("last_seen_at", "TIMESTAMP"),
+        ("last_join_at", "TIMESTAMP"),
+        ("join_count", "INT NOT NULL DEFAULT 0"),
+    ],
+}
+
+async def ensure_columns():
+    conn = Tortoise.get_connection("default")
+    for table, columns in _ADDED_COLUMNS.items():
+        _, rows = await conn.execute_query(f'PRAGMA table_info("{table}")')
+        existing = {row["name"] for row in rows}
+        for name, ddl in columns:
+            if name not in existing:
+                await conn.execute_script(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {ddl}')
+
+# Indexes the ORM does not declare: NOCASE name indexes back the admin
+# directory's case-insensitive prefix search, hash lookups find every
+# record sharing a texture file, and the per-user ones serve the manager's
+# keyset pages.
+_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS "idx_user_username_nocase" ON "user" ("username" COLLATE NOCASE, "id")',
+    'CREATE INDEX IF NOT EXISTS "idx_player_name_nocase" ON "player" ("name" COLLATE NOCASE, "id")',
+    'CREATE INDEX IF NOT EXISTS "idx_texture_hash" ON "texture" ("hash")',
+    # Keyset pages of the skin manager: one user's textures of one type, and
+    # one user's players, in id order
+    'CREATE INDEX IF NOT EXISTS "idx_texture_uploader_type_id" ON "texture" ("uploader_id", "type", "id")',
+    'CREATE INDEX IF NOT EXISTS "idx_player_user_id" ON "player" ("user_id", "id")',
+]
+
+async def ensure_indexes():
+    conn = Tortoise.get_connection("default")
+    for ddl in _INDEXES:
+        await conn.execute_script(ddl)
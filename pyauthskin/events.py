@@ -0,0 +1,151 @@
+# pyauthskin/events.py
+import asyncio
+import itertools
+import json
+import secrets
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi import APIRouter, Header, Query, Request
+from fastapi.responses import StreamingResponse
+
+from config import AUTH_API_PREFIX, EVENTS_HISTORY_SIZE, EVENTS_SUBSCRIBER_BUFFER, EVENTS_HEARTBEAT_SECONDS
+
+router = APIRouter(prefix=AUTH_API_PREFIX, tags=["Events"])
+
+
+class _Subscriber:
+    __slots__ = ("queue",)
+
+    def __init__(self, buffer_size: int):
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+
+
+class EventBus:
+    """In-process pub/sub for profile change events.
+
+    Every subscriber has a bounded buffer; a subscriber that falls behind far
+    enough to fill it is dropped rather than slowing down publishers. The
+    last EVENTS_HISTORY_SIZE events are kept so a reconnecting client can
+    resume from the id it last saw.
+
+    Event ids are "<epoch>-<seq>": the sequence restarts with the process, so
+    a random per-process epoch tells ids from different runs (or workers)
+    apart.
+    """
+
+    def __init__(self, history_size: int = EVENTS_HISTORY_SIZE, buffer_size: int = EVENTS_SUBSCRIBER_BUFFER):
+        self.buffer_size = buffer_size
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self.epoch = secrets.token_hex(4)
+        self._seqs = itertools.count(1)
+        self.last_seq = 0
+        self.stats = {"published": 0, "dropped_subscribers": 0}
+
+    @property
+    def last_id(self) -> str:
+        return self.event_id(self.last_seq)
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def publish(self, event_type: str, **data) -> None:
+        self.last_seq = next(self._seqs)
+        event = (self.last_seq, event_type, json.dumps({"type": event_type, "timestamp": int(time.time() * 1000), **data},
+                                                      separators=(',', ':'), ensure_ascii=False))
+        self._history.append(event)
+        self.stats["published"] += 1
+        for sub in list(self._subscribers):
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub: _Subscriber) -> None:
+        self._subscribers.discard(sub)
+        self.stats["dropped_subscribers"] += 1
+        # Make room for the sentinel so the reader wakes up and ends the stream
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+    def subscribe(self, last_event_id: Optional[str] = None):
+        """Registers a subscriber and returns it with any backlog to replay.
+
+        Returns backlog None if the requested id is from another process, is
+        malformed, or has already been evicted from history, meaning the
+        client missed events and must resynchronise.
+        """
+        sub = _Subscriber(self.buffer_size)
+        backlog = []
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition("-")
+            if epoch != self.epoch or not seq.isdigit() or int(seq) > self.last_seq:
+                backlog = None
+            elif int(seq) < self.last_seq:
+                seq = int(seq)
+                oldest = self._history[0][0] if self._history else self.last_seq + 1
+                if seq + 1 < oldest:
+                    backlog = None
+                else:
+                    backlog = [e for e in self._history if e[0] > seq]
+        self._subscribers.add(sub)
+        return sub, backlog
+
+    def unsubscribe(self, sub: _Subscriber) -> None:
+        self._subscribers.discard(sub)
+
+    def snapshot(self) -> dict:
+        return {"subscribers": len(self._subscribers), "last_id": self.last_id,
+                "history": len(self._history), **self.stats}
+
+
+event_bus = EventBus()
+
+
+def _format(event) -> str:
+    seq, event_type, payload = event
+    return f"id: {event_bus.event_id(seq)}\nevent: {event_type}\ndata: {payload}\n\n"
+
+
+@router.get("/events/profiles")
+async def profile_events(request: Request, last_event_id: Optional[str] = Query(None),
+                         last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """Server-sent event stream of skin and player changes.
+
+    Game servers can keep this open and invalidate cached profiles instead of
+    polling the profile endpoint. Reconnect with Last-Event-ID (or
+    ?last_event_id=) to resume; a `reset` event means events were missed and
+    every cached profile should be dropped.
+    """
+    if last_event_id is None:
+        last_event_id = last_event_id_header
+    sub, backlog = event_bus.subscribe(last_event_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if backlog is None:
+                yield _format((event_bus.last_seq, "reset", json.dumps({"type": "reset"})))
+            else:
+                for event in backlog:
+                    yield _format(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    # Dropped for falling behind; the client reconnects and resumes
+                    break
+                yield _format(event)
+        finally:
+            event_bus.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
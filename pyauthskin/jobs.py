@@ -0,0 +1,138 @@
+# pyauthskin/jobs.py
+import asyncio
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import DATA_DIR, JOB_WORKERS, JOB_QUEUE_SIZE
+
+# Every job is persisted as data/jobs/<id>.json plus an optional <id>.blob
+# before it is queued, so work accepted before a restart is picked up again
+# by the next start().
+JOBS_DIR = DATA_DIR / "jobs"
+
+# kind -> async handler(job: dict, blob_path: Path)
+_handlers = {}
+
+
+def job_handler(kind: str):
+    """Registers the coroutine that processes jobs of `kind`."""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def _fsync_write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def blob_path_for(job_id: str) -> Path:
+    """Where a job's payload is written before the job is submitted."""
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    return JOBS_DIR / f"{job_id}.blob"
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def discard_job(job_id: str) -> None:
+    """Removes a job's files, e.g. a blob whose upload was rejected."""
+    for suffix in (".json", ".blob"):
+        (JOBS_DIR / f"{job_id}{suffix}").unlink(missing_ok=True)
+
+
+class JobQueue:
+    """Bounded in-process queue of durable jobs, drained by worker tasks."""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_size: int = JOB_QUEUE_SIZE):
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._tasks = []
+        # Ids queued in this process, so start() does not resume them twice
+        self._known = set()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    async def submit(self, kind: str, payload: dict, job_id: Optional[str] = None) -> Optional[str]:
+        """Persists and queues a job; returns its id, or None if the queue is full.
+
+        If the job has a blob, write it to blob_path_for(job_id) first. When
+        None is returned the job's files are removed.
+        """
+        job_id = job_id or new_job_id()
+        if not self._queue.full():
+            JOBS_DIR.mkdir(parents=True, exist_ok=True)
+            record = json.dumps({"id": job_id, "kind": kind, **payload}).encode("utf-8")
+            await run_in_threadpool(_fsync_write, JOBS_DIR / f"{job_id}.json", record)
+            # Concurrent submits may have filled the queue during the write
+            try:
+                self._queue.put_nowait(job_id)
+            except asyncio.QueueFull:
+                pass
+            else:
+                self._known.add(job_id)
+                self.stats["submitted"] += 1
+                return job_id
+        self.stats["rejected"] += 1
+        await run_in_threadpool(discard_job, job_id)
+        return None
+
+    async def _run(self, job_id: str) -> None:
+        record_path = JOBS_DIR / f"{job_id}.json"
+        try:
+            job = json.loads(await run_in_threadpool(record_path.read_bytes))
+            handler = _handlers[job["kind"]]
+            await handler(job, JOBS_DIR / f"{job_id}.blob")
+            self.stats["completed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Job {job_id} failed: {e}")
+        # Not in a finally: a job interrupted by stop() keeps its files
+        await run_in_threadpool(discard_job, job_id)
+        self._known.discard(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _requeue_pending(self) -> None:
+        if not JOBS_DIR.exists():
+            return
+        pending = sorted(JOBS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        pending = [p.stem for p in pending if p.stem not in self._known]
+        self._known.update(pending)
+        for job_id in pending:
+            await self._queue.put(job_id)
+        if pending:
+            print(f"Resumed {len(pending)} pending job(s)")
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._requeue_pending()))
+
+    async def stop(self) -> None:
+        # Unfinished jobs stay on disk and are resumed on the next start
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def snapshot(self) -> dict:
+        return {"workers": self.workers, "queued": self._queue.qsize(), **self.stats}
+
+
+job_queue = JobQueue()
@@ -1,6 +1,150 @@
 # keystore.py
-from cryptography.hazmat.primitives.asymmetric import rsa
+import itertools
+import os
+import time
+from pathlib import Path
+from typing import Optional
 
-# These will be populated at startup by main.py
-SIGNING_PRIVATE_KEY: rsa.RSAPrivateKey | None = None
+from config import SIGNING_KEY_CHECK_SECONDS
+
+# The active key pair, populated at startup by load_keys(). The private key
+# is kept as PEM bytes so it can be handed to signing workers (threads or
+# processes), which parse and cache it per generation. The public key is the
+# PEM text served by the metadata endpoint.
 SIGNATURE_PUBLIC_KEY_B64: str = ""
+
+
+class KeyPair:
+    __slots__ = ("generation", "private_pem", "public_pem", "file_state")
+
+    def __init__(self, generation: int, private_pem: bytes, public_pem: str, file_state):
+        self.generation = generation
+        self.private_pem = private_pem
+        self.public_pem = public_pem
+        self.file_state = file_state
+
+
+_current: Optional[KeyPair] = None
+_paths = None
+_generations = itertools.count(1)
+_last_check = 0.0
+# Called with the new KeyPair after every (re)load, e.g. to rebuild metadata
+_listeners = []
+
+
+def _write_key_pair(private_key_path: Path, public_key_path: Path) -> None:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key_obj = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key_obj.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    public_pem = private_key_obj.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    # Write both halves before swapping either in, so the window in which a
+    # reloading worker could see only one new half is two renames long; the
+    # changed file state makes its next check reload the full pair anyway.
+    for path, data in ((private_key_path, private_pem), (public_key_path, public_pem)):
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+    os.replace(private_key_path.with_name(private_key_path.name + ".tmp"), private_key_path)
+    os.replace(public_key_path.with_name(public_key_path.name + ".tmp"), public_key_path)
+
+
+def _normalize_public_pem(pem: bytes) -> str:
+    # authlib-injector expects a SubjectPublicKeyInfo PEM block for
+    # signaturePublickey. Files we generated already are one, so only other
+    # formats (e.g. PKCS#1 "RSA PUBLIC KEY") need a parse/re-serialize.
+    if pem.lstrip().startswith(b"-----BEGIN PUBLIC KEY-----"):
+        return pem.decode("utf-8")
+    from cryptography.hazmat.primitives import serialization
+    public_key_obj = serialization.load_pem_public_key(pem)
+    return public_key_obj.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode("utf-8")
+
+
+def _file_state(private_key_path: Path, public_key_path: Path):
+    a, b = private_key_path.stat(), public_key_path.stat()
+    return (a.st_mtime_ns, a.st_size, b.st_mtime_ns, b.st_size)
+
+
+def _load(private_key_path: Path, public_key_path: Path) -> None:
+    global _current, SIGNATURE_PUBLIC_KEY_B64
+    state = _file_state(private_key_path, public_key_path)
+    key_pair = KeyPair(next(_generations), private_key_path.read_bytes(),
+                       _normalize_public_pem(public_key_path.read_bytes()), state)
+    # Single assignment: requests already holding the old pair finish with it
+    _current = key_pair
+    SIGNATURE_PUBLIC_KEY_B64 = key_pair.public_pem
+    for listener in _listeners:
+        listener(key_pair)
+
+
+def load_keys(private_key_path: Path, public_key_path: Path) -> None:
+    """Generates the key pair if missing and loads it. Idempotent."""
+    global _paths
+    if _current is not None and _paths == (private_key_path, public_key_path):
+        return
+    if not public_key_path.exists() or not private_key_path.exists():
+        print("Generating new RSA key pair...")
+        _write_key_pair(private_key_path, public_key_path)
+    _paths = (private_key_path, public_key_path)
+    _load(private_key_path, public_key_path)
+
+
+def reload_if_changed() -> bool:
+    """Picks up key files replaced on disk (e.g. rotated by another worker).
+
+    Only stats the files every SIGNING_KEY_CHECK_SECONDS, so it is cheap to
+    call on every signature.
+    """
+    global _last_check
+    now = time.monotonic()
+    if _paths is None or now - _last_check < SIGNING_KEY_CHECK_SECONDS:
+        return False
+    _last_check = now
+    try:
+        state = _file_state(*_paths)
+    except OSError:
+        return False
+    if _current is not None and state == _current.file_state:
+        return False
+    print("Key files changed on disk, reloading signing key...")
+    try:
+        _load(*_paths)
+    except (OSError, ValueError) as e:
+        # Keep signing with the current pair; the next check retries
+        print(f"Key reload failed: {e}")
+        return False
+    return True
+
+
+def rotate_keys(generate: bool = True) -> KeyPair:
+    """Switches to a new key pair without a restart.
+
+    With generate=True a fresh pair is written over the key files first;
+    otherwise the files (replaced by an operator) are simply reloaded. Other
+    workers notice the new files through reload_if_changed().
+    """
+    if _paths is None:
+        raise RuntimeError("Keys have not been loaded yet.")
+    if generate:
+        print("Rotating RSA key pair...")
+        _write_key_pair(*_paths)
+    _load(*_paths)
+    return _current
+
+
+def current_key_pair() -> Optional[KeyPair]:
+    return _current
+
+
+def add_listener(callback) -> None:
+    _listeners.append(callback)
@@ -0,0 +1,140 @@
+# pyauthskin/loadshed.py
+import asyncio
+import heapq
+import itertools
+
+from fastapi import Depends, HTTPException
+
+from config import (LOAD_SHED_LIMITS, LOAD_SHED_GLOBAL_LIMIT, LOAD_SHED_MAX_WAIT_SECONDS,
+                    LOAD_SHED_RETRY_AFTER_SECONDS)
+
+# Lower value = served first. Where a limiter is shared by several
+# priorities, the lower ones also get a smaller share of its wait queue, so
+# they are shed before anything that lets players join.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Queue share by rank among the priorities that use a limiter: the best one
+# gets the whole queue, so a class used by a single priority keeps its
+# configured depth
+_QUEUE_SHARE = (1.0, 0.75, 0.5)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class WorkLimiter:
+    """Concurrency limit with a bounded, priority-ordered wait queue.
+
+    When all slots are busy, callers queue until a slot frees up or
+    LOAD_SHED_MAX_WAIT_SECONDS passes. When the queue is full for the
+    caller's priority, it is rejected straight away with Overloaded.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait: float = LOAD_SHED_MAX_WAIT_SECONDS):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        # Priorities of the routes using this limiter, registered by shed()
+        self.priorities = set()
+        self.stats = {"admitted": 0, "queued": 0, "shed": 0, "timeouts": 0}
+
+    def queue_limit(self, priority: int) -> int:
+        rank = sum(1 for p in self.priorities if p < priority)
+        return int(self.max_queue * _QUEUE_SHARE[min(rank, len(_QUEUE_SHARE) - 1)])
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        if self.active < self.concurrency and not self.waiting:
+            self.active += 1
+            self.stats["admitted"] += 1
+            return
+        if self.waiting >= self.queue_limit(priority):
+            self.stats["shed"] += 1
+            raise Overloaded(self.name)
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self.waiting += 1
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait_for(fut, self.max_wait)
+        except BaseException as e:
+            # Gave up after release() already handed us the slot; pass it on
+            if fut.done() and not fut.cancelled():
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+                raise Overloaded(self.name)
+            raise
+        finally:
+            self.waiting -= 1
+        self.stats["admitted"] += 1
+
+    def release(self) -> None:
+        # Hand the slot straight to the best waiter, skipping any that gave up
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "queue_limits": {p: self.queue_limit(p) for p in sorted(self.priorities)},
+            "active": self.active,
+            "waiting": self.waiting,
+            **self.stats,
+        }
+
+
+limiters = {name: WorkLimiter(name, concurrency, max_queue)
+            for name, (concurrency, max_queue) in LOAD_SHED_LIMITS.items()}
+
+# Shared by every class. Its waiters are served strictly by priority, so
+# when the server as a whole is saturated hasJoined/join take the next free
+# slot ahead of queued page views and uploads from the other classes.
+global_limiter = WorkLimiter("global", *LOAD_SHED_GLOBAL_LIMIT)
+
+
+def _busy(work_class: str) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"Server busy ({work_class}), please retry",
+                         headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)})
+
+
+def shed(work_class: str, priority: int = PRIORITY_NORMAL):
+    """Route dependency that holds a slot of `work_class`, then a global slot, for the request.
+
+    Usage: @router.get(..., dependencies=[shed("signing", PRIORITY_HIGH)])
+    """
+    limiter = limiters[work_class]
+    limiter.priorities.add(priority)
+    global_limiter.priorities.add(priority)
+
+    async def dependency():
+        try:
+            await limiter.acquire(priority)
+        except Overloaded:
+            raise _busy(work_class)
+        try:
+            try:
+                await global_limiter.acquire(priority)
+            except Overloaded:
+                raise _busy(work_class)
+            try:
+                yield
+            finally:
+                global_limiter.release()
+        finally:
+            limiter.release()
+
+    return Depends(dependency)
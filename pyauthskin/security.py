@@ -1,5 +1,24 @@
 # security.py
-from passlib.context import CryptContext
+
+
+class _LazyCryptContext:
+    """Builds the passlib CryptContext on first use.
+
+    Importing passlib and loading the argon2 backend is only paid by the
+    first request that actually hashes or verifies a password, not by every
+    worker at startup.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._context = None
+
+    def __getattr__(self, name):
+        if self._context is None:
+            from passlib.context import CryptContext
+            self._context = CryptContext(**self._kwargs)
+        return getattr(self._context, name)
+
 
 # Define the password context once and import it where needed
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+pwd_context = _LazyCryptContext(schemes=["argon2"], deprecated="auto")
@@ -0,0 +1,121 @@
+# pyauthskin/signing.py
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import SIGNING_EXECUTOR, SIGNING_WORKERS, SIGNING_BATCH_MAX, SIGNING_BATCH_WINDOW_MS
+from . import keystore
+
+# Parsed private keys by generation, per worker process
+_key_cache = {}
+
+
+def _sign_batch(generation: int, private_pem: bytes, items: list) -> list:
+    """Signs every item with the given key. Runs in a worker thread or process."""
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    key = _key_cache.get(generation)
+    if key is None:
+        key = serialization.load_pem_private_key(private_pem, password=None)
+        _key_cache.clear()
+        _key_cache[generation] = key
+    return [key.sign(data, padding.PKCS1v15(), hashes.SHA1()) for data in items]
+
+
+class SigningService:
+    """Signs profile textures on a thread or process pool.
+
+    Requests arriving within SIGNING_BATCH_WINDOW_MS of each other (a burst
+    of hasJoined calls as a server fills up) are handed to the pool as one
+    batch, so the event loop only pays one executor round trip per batch.
+    Each batch is bound to the key pair that was current when it was sent,
+    so rotating keys never changes the key under an in-flight request.
+    """
+
+    def __init__(self, mode: str = SIGNING_EXECUTOR, workers: int = SIGNING_WORKERS,
+                 batch_max: int = SIGNING_BATCH_MAX, batch_window_ms: float = SIGNING_BATCH_WINDOW_MS):
+        self.mode = mode
+        self.workers = workers
+        self.batch_max = batch_max
+        self.batch_window = batch_window_ms / 1000
+        self._executor = None
+        self._pending = []
+        self._flush_handle = None
+        self.stats = {"signatures": 0, "batches": 0, "errors": 0}
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="signing")
+        return self._executor
+
+    async def sign(self, data: bytes) -> bytes:
+        keystore.reload_if_changed()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((data, fut))
+        if len(self._pending) >= self.batch_max:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await fut
+
+    async def sign_many(self, items) -> list:
+        """Signs several payloads; they share batches with concurrent callers."""
+        return list(await asyncio.gather(*(self.sign(data) for data in items)))
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        key_pair = keystore.current_key_pair()
+        if key_pair is None:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(RuntimeError("Server private key not loaded."))
+            return
+
+        self.stats["batches"] += 1
+        done = asyncio.wrap_future(self._get_executor().submit(
+            _sign_batch, key_pair.generation, key_pair.private_pem, [data for data, _ in batch]))
+
+        def deliver(result):
+            if result.cancelled() or result.exception() is not None:
+                self.stats["errors"] += 1
+                error = RuntimeError("Signing failed") if result.cancelled() else result.exception()
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(error)
+                return
+            self.stats["signatures"] += len(batch)
+            for (_, fut), signature in zip(batch, result.result()):
+                if not fut.done():
+                    fut.set_result(signature)
+
+        done.add_done_callback(deliver)
+
+    def snapshot(self) -> dict:
+        key_pair = keystore.current_key_pair()
+        batches = self.stats["batches"] or 1
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "key_generation": key_pair.generation if key_pair else None,
+            "pending": len(self._pending),
+            "avg_batch_size": round(self.stats["signatures"] / batches, 2),
+            **self.stats,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+signing_service = SigningService()
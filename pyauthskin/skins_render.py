@@ -1,6 +1,6 @@
-from PIL import Image
-
 def generate_avatar(skin_path, output_path, width, height):
+    # Imported here so PIL is only loaded once a skin is actually rendered
+    from PIL import Image
     try:
         with Image.open(skin_path) as img:
             img = img.convert("RGBA")
@@ -45,3 +45,31 @@ def generate_avatar(skin_path, output_path, width, height):
 
     except Exception as e:
         pass # Suppress error logging in production, or use a proper logger
+
+def generate_cape_preview(cape_path, output_path, width, height):
+    # Imported here so PIL is only loaded once a cape is actually rendered
+    from PIL import Image
+    try:
+        with Image.open(cape_path) as img:
+            img = img.convert("RGBA")
+
+            # The outer face of the cape sits at (1, 1) with size 10x16 on the
+            # 64x32 layout (22x17 legacy capes use the same corner).
+            CAPE_FRONT = (1, 1, 10, 16)
+            scale_factor = width / 64 if width >= 64 else 1
+
+            x1 = int(CAPE_FRONT[0] * scale_factor)
+            y1 = int(CAPE_FRONT[1] * scale_factor)
+            x2 = int((CAPE_FRONT[0] + CAPE_FRONT[2]) * scale_factor)
+            y2 = int((CAPE_FRONT[1] + CAPE_FRONT[3]) * scale_factor)
+            front = img.crop((x1, y1, x2, y2))
+
+            # Center the 10x16 face on a square canvas so it fits the same
+            # 128x128 slot as skin avatars
+            front = front.resize((80, 128), Image.NEAREST)
+            preview = Image.new("RGBA", (128, 128), (0, 0, 0, 0))
+            preview.paste(front, (24, 0), front)
+            preview.save(output_path)
+
+    except Exception as e:
+        pass # Suppress error logging in production, or use a proper logger
@@ -0,0 +1,189 @@
+# pyauthskin/sprites.py
+import asyncio
+import json
+import os
+import weakref
+from pathlib import Path
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import DATA_DIR, SPRITE_THUMB_SIZE, SPRITE_COLUMNS
+from .database import Texture
+
+# One sheet per user: data/sprites/<user_id>.png plus a <user_id>.json
+# manifest mapping each slot of the grid to a texture id. Slots of deleted
+# skins are blanked and reused by the next upload, so the sheet is only ever
+# patched, never rebuilt, once it exists.
+SPRITES_DIR = DATA_DIR / "sprites"
+
+# One lock per user keeps that user's manifest read-modify-write safe
+# without queueing everyone else's uploads behind a large sheet. Locks are
+# dropped once no coroutine holds a reference.
+_locks = weakref.WeakValueDictionary()
+
+
+def _lock_for(user_id: int) -> asyncio.Lock:
+    lock = _locks.get(user_id)
+    if lock is None:
+        lock = _locks[user_id] = asyncio.Lock()
+    return lock
+
+
+def avatar_path_for(texture_path: str, texture_type: str = "skin") -> Path:
+    # Derived image of a texture file: the head avatar of a skin, or the
+    # front preview of a cape (separate names, since the same bytes could in
+    # principle be uploaded as both)
+    p = Path(texture_path)
+    suffix = "_cape.png" if texture_type == "cape" else "_avatar.png"
+    return p.parent / f"{p.stem}{suffix}"
+
+
+def _paths(user_id: int):
+    return SPRITES_DIR / f"{user_id}.png", SPRITES_DIR / f"{user_id}.json"
+
+
+def _load_manifest(user_id: int) -> Optional[dict]:
+    sheet_path, manifest_path = _paths(user_id)
+    if not sheet_path.exists() or not manifest_path.exists():
+        return None
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _slot_box(slot: int):
+    x = (slot % SPRITE_COLUMNS) * SPRITE_THUMB_SIZE
+    y = (slot // SPRITE_COLUMNS) * SPRITE_THUMB_SIZE
+    return x, y, x + SPRITE_THUMB_SIZE, y + SPRITE_THUMB_SIZE
+
+
+def _sheet_size(slot_count: int):
+    rows = max(1, -(-slot_count // SPRITE_COLUMNS))
+    return SPRITE_COLUMNS * SPRITE_THUMB_SIZE, rows * SPRITE_THUMB_SIZE
+
+
+def _paste_avatar(sheet, slot: int, avatar_path: Path) -> None:
+    from PIL import Image
+    box = _slot_box(slot)
+    sheet.paste((0, 0, 0, 0), box)
+    try:
+        with Image.open(avatar_path) as avatar:
+            thumb = avatar.convert("RGBA").resize((SPRITE_THUMB_SIZE, SPRITE_THUMB_SIZE), Image.NEAREST)
+    except OSError:
+        # Missing avatar; leave the slot transparent
+        return
+    sheet.paste(thumb, box[:2])
+
+
+def _save(user_id: int, sheet, manifest: dict, optimize: bool = False) -> None:
+    SPRITES_DIR.mkdir(parents=True, exist_ok=True)
+    sheet_path, manifest_path = _paths(user_id)
+    tmp_sheet = sheet_path.with_suffix(".png.tmp")
+    sheet.save(tmp_sheet, format="PNG", optimize=optimize)
+    os.replace(tmp_sheet, sheet_path)
+    tmp_manifest = manifest_path.with_suffix(".json.tmp")
+    tmp_manifest.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp_manifest, manifest_path)
+
+
+def _rebuild(user_id: int, entries) -> dict:
+    from PIL import Image
+    old = _load_manifest(user_id)
+    manifest = {"version": (old["version"] + 1) if old else 1, "slots": [tid for tid, _ in entries]}
+    sheet = Image.new("RGBA", _sheet_size(len(entries)), (0, 0, 0, 0))
+    for slot, (_, avatar_path) in enumerate(entries):
+        _paste_avatar(sheet, slot, avatar_path)
+    # Full builds are rare, so they pay for the smaller encoding; patches
+    # keep the default to stay cheap
+    _save(user_id, sheet, manifest, optimize=True)
+    return manifest
+
+
+def _apply(user_id: int, added, removed) -> Optional[dict]:
+    from PIL import Image
+    manifest = _load_manifest(user_id)
+    if manifest is None:
+        return None
+    slots = manifest["slots"]
+    sheet_path, _ = _paths(user_id)
+    with Image.open(sheet_path) as img:
+        sheet = img.convert("RGBA")
+
+    for texture_id in removed:
+        if texture_id in slots:
+            slot = slots.index(texture_id)
+            slots[slot] = None
+            sheet.paste((0, 0, 0, 0), _slot_box(slot))
+    for texture_id, avatar_path in added:
+        if texture_id in slots:
+            slot = slots.index(texture_id)
+        elif None in slots:
+            slot = slots.index(None)
+            slots[slot] = texture_id
+        else:
+            slot = len(slots)
+            slots.append(texture_id)
+        if sheet.size != _sheet_size(len(slots)):
+            grown = Image.new("RGBA", _sheet_size(len(slots)), (0, 0, 0, 0))
+            grown.paste(sheet, (0, 0))
+            sheet = grown
+        _paste_avatar(sheet, slot, avatar_path)
+
+    manifest["version"] += 1
+    _save(user_id, sheet, manifest)
+    return manifest
+
+
+async def get_sprite_manifest(user) -> dict:
+    """Returns the user's sheet manifest, building the sheet on first use."""
+    manifest = await run_in_threadpool(_load_manifest, user.id)
+    if manifest is not None:
+        return manifest
+    async with _lock_for(user.id):
+        manifest = await run_in_threadpool(_load_manifest, user.id)
+        if manifest is not None:
+            return manifest
+        textures = await Texture.filter(uploader=user).order_by("id").values("id", "path", "type")
+        entries = [(t["id"], avatar_path_for(t["path"], t["type"])) for t in textures]
+        return await run_in_threadpool(_rebuild, user.id, entries)
+
+
+async def update_sprite_sheet(user, added=(), removed=()) -> None:
+    """Patches the user's sheet in place.
+
+    `added` is a sequence of (texture_id, avatar_path), `removed` of
+    texture ids. Nothing happens if the sheet has not been built yet; it is
+    built from the database on the next get_sprite_manifest().
+    """
+    async with _lock_for(user.id):
+        await run_in_threadpool(_apply, user.id, list(added), list(removed))
+
+
+def sprite_position(manifest: dict, texture_id: int) -> Optional[dict]:
+    """Pixel offset of a texture's thumbnail within the sheet, if present."""
+    slots = manifest["slots"]
+    if texture_id not in slots:
+        return None
+    x, y, _, _ = _slot_box(slots.index(texture_id))
+    return {"x": x, "y": y}
+
+
+def sprite_style(manifest: dict, texture_id: int) -> Optional[str]:
+    """Inline CSS that shows one thumbnail of the sheet, scaled to the element."""
+    slots = manifest["slots"]
+    if texture_id not in slots:
+        return None
+    slot = slots.index(texture_id)
+    columns = SPRITE_COLUMNS
+    rows = max(1, -(-len(slots) // columns))
+    col, row = slot % columns, slot // columns
+    pos_x = col * 100 / (columns - 1) if columns > 1 else 0
+    pos_y = row * 100 / (rows - 1) if rows > 1 else 0
+    return (f"background-size:{columns * 100}% {rows * 100}%;"
+            f"background-position:{pos_x:.4f}% {pos_y:.4f}%")
+
+
+def sheet_path_for(user_id: int) -> Path:
+    return _paths(user_id)[0]
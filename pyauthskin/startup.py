@@ -0,0 +1,29 @@
+# pyauthskin/startup.py
+import time
+
+# Startup timing. main.py imports this module first, so times are measured
+# from the start of the app import to the end of the lifespan startup.
+_T0 = time.perf_counter()
+_last = _T0
+phases = []
+
+
+def mark(phase: str) -> None:
+    """Records the time spent since the previous mark under `phase`."""
+    global _last
+    now = time.perf_counter()
+    phases.append((phase, now - _last))
+    _last = now
+
+
+def report() -> dict:
+    return {
+        "total_ms": round((_last - _T0) * 1000, 1),
+        "phases": [{"phase": name, "ms": round(seconds * 1000, 1)} for name, seconds in phases],
+    }
+
+
+def print_report() -> None:
+    r = report()
+    details = ", ".join(f"{p['phase']} {p['ms']} ms" for p in r["phases"])
+    print(f"Startup finished in {r['total_ms']} ms ({details})")
@@ -0,0 +1,251 @@
+# pyauthskin/texture_api.py
+import os
+from pathlib import Path
+
+from fastapi import APIRouter, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+# The parser Starlette itself uses for forms (python-multipart); it is
+# driven directly here so the upload never gets spooled in full
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from config import AUTH_API_PREFIX, TEXTURE_UPLOAD_MAX_BYTES, LOAD_SHED_RETRY_AFTER_SECONDS
+from .database import User, Player
+from .tokens import get_token
+from .textures import png_size, is_valid_skin_size, is_valid_cape_size, store_texture
+from .jobs import job_queue, job_handler, blob_path_for, discard_job, new_job_id
+from .events import event_bus
+from .writes import write_batcher
+
+# Yggdrasil texture upload API (used by launchers through authlib-injector):
+#   PUT    /api/user/profile/{uuid}/{skin|cape}   multipart "file" (+ "model")
+#   DELETE /api/user/profile/{uuid}/{skin|cape}
+# The multipart body is parsed as it arrives and the "file" part written
+# straight to the job's blob, stopping as soon as it passes
+# TEXTURE_UPLOAD_MAX_BYTES. The request is acknowledged with 204 once the
+# job is persisted; decoding, avatar rendering and the sprite sheet update
+# run on the background job workers.
+router = APIRouter(prefix=AUTH_API_PREFIX, tags=["Yggdrasil"])
+
+TEXTURE_TYPES = ("skin", "cape")
+# Room for multipart boundaries, part headers and the "model" field on top
+# of the file itself when judging Content-Length up front
+_MULTIPART_OVERHEAD = 16 * 1024
+# Non-file fields are tiny ("model"); anything longer is cut off
+_MAX_FIELD_BYTES = 1024
+
+
+class _TextureUpload:
+    """python-multipart callbacks: the "file" part goes to `pending` chunks, other parts to `fields`."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.file_bytes = 0
+        self.has_file = False
+        self.too_large = False
+        self.fields = {}
+        # File data parsed but not yet written to disk
+        self.pending = []
+        self._headers = {}
+        self._field = b""
+        self._value = b""
+        self._name = ""
+        self._data = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self):
+        self._headers = {}
+        self._name = ""
+        self._data = bytearray()
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = params.get(b"name", b"").decode("latin-1")
+        if self._name == "file":
+            self.has_file = True
+
+    def _part_data(self, data, start, end):
+        if self._name == "file":
+            self.file_bytes += end - start
+            if self.file_bytes > self.max_bytes:
+                self.too_large = True
+            elif not self.too_large:
+                self.pending.append(data[start:end])
+        elif len(self._data) < _MAX_FIELD_BYTES:
+            self._data += data[start:end]
+
+    def _part_end(self):
+        if self._name and self._name != "file":
+            self.fields[self._name] = self._data[:_MAX_FIELD_BYTES].decode("utf-8", "replace")
+
+
+def _write_chunks(f, chunks) -> None:
+    for chunk in chunks:
+        f.write(chunk)
+
+
+def _finish_blob(f) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+async def _receive_upload(request: Request, job_id: str):
+    """Streams the multipart body into the job's blob.
+
+    Returns (fields, None) on success, or (None, error response); the blob
+    is removed on error.
+    """
+    too_large = _error(413, "IllegalArgumentException", f"File too large (max {TEXTURE_UPLOAD_MAX_BYTES} bytes).")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > TEXTURE_UPLOAD_MAX_BYTES + _MULTIPART_OVERHEAD:
+        # Refuse before reading any of the body
+        return None, too_large
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        return None, _error(400, "IllegalArgumentException", "Expected a multipart/form-data body.")
+
+    upload = _TextureUpload(TEXTURE_UPLOAD_MAX_BYTES)
+    parser = MultipartParser(params[b"boundary"], upload.callbacks())
+    f = await run_in_threadpool(open, blob_path_for(job_id), "wb")
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if upload.too_large:
+                break
+            if upload.pending:
+                chunks, upload.pending = upload.pending, []
+                await run_in_threadpool(_write_chunks, f, chunks)
+        if not upload.too_large:
+            parser.finalize()
+    except Exception:
+        upload.has_file = False
+    finally:
+        await run_in_threadpool(_finish_blob, f)
+
+    if upload.too_large:
+        error = too_large
+    elif not upload.has_file:
+        error = _error(400, "IllegalArgumentException", "Missing or malformed \"file\" part.")
+    else:
+        return upload.fields, None
+    await run_in_threadpool(discard_job, job_id)
+    return None, error
+
+
+def _error(status_code: int, error: str, message: str, headers=None) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"error": error, "errorMessage": message}, headers=headers)
+
+
+async def _authorized_player(request: Request, uuid: str, texture_type: str):
+    """Returns (player, None) for the bearer token's own profile, else (None, error response)."""
+    if texture_type not in TEXTURE_TYPES:
+        return None, _error(404, "Not Found", "Unknown texture type.")
+    scheme, _, access_token = request.headers.get("authorization", "").partition(" ")
+    token = await get_token(access_token.strip()) if scheme.lower() == "bearer" else None
+    if token is None:
+        return None, _error(401, "Unauthorized", "Invalid token.")
+    player = await Player.filter(uuid=uuid.replace("-", ""), user_id=token.user_id).first()
+    if player is None:
+        return None, _error(403, "ForbiddenOperationException", "Profile does not belong to this token.")
+    return player, None
+
+
+# Not in a load-shed class: a slot would be held for the whole body
+# transfer, while the handler itself only writes to disk. The PIL work runs
+# on the job workers, and a full job queue is answered with 503 below.
+@router.put("/api/user/profile/{uuid}/{texture_type}")
+async def upload_texture(uuid: str, texture_type: str, request: Request):
+    """Multipart form with a "file" part and, for skins, "model" ("slim" or empty)."""
+    # Authorised from the headers alone, before any of the body is read
+    player, error = await _authorized_player(request, uuid, texture_type)
+    if error is not None:
+        return error
+
+    job_id = new_job_id()
+    fields, error = await _receive_upload(request, job_id)
+    if error is not None:
+        return error
+
+    payload = {
+        "user_id": player.user_id,
+        "player_id": player.id,
+        "texture_type": texture_type,
+        "model": "slim" if fields.get("model") == "slim" else "classic",
+    }
+    if await job_queue.submit("texture_upload", payload, job_id=job_id) is None:
+        return _error(503, "Service Unavailable", "Too many pending uploads, try again later.",
+                      headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)})
+    return Response(status_code=204)
+
+
+@job_handler("texture_upload")
+async def process_texture_upload(job: dict, blob_path: Path) -> None:
+    contents = await run_in_threadpool(blob_path.read_bytes)
+    size = await run_in_threadpool(png_size, contents)
+    texture_type = job["texture_type"]
+    valid_size = is_valid_cape_size if texture_type == "cape" else is_valid_skin_size
+    if size is None or not valid_size(*size):
+        print(f"Rejected {texture_type} upload for player {job['player_id']}: invalid image {size}")
+        return
+
+    user = await User.filter(id=job["user_id"]).first()
+    player = await Player.filter(id=job["player_id"], user_id=job["user_id"]).first()
+    if user is None or player is None:
+        # Deleted while the upload was queued
+        return
+
+    texture = await store_texture(user, contents, size, texture_type,
+                                  display_name=f"{player.name} ({texture_type})", model=job["model"])
+    if texture_type == "cape":
+        player.cape_texture = texture
+        await write_batcher.save(player, update_fields=["cape_texture_id"])
+        event_bus.publish("player_cape_set", uuid=player.uuid, name=player.name,
+                          texture=Path(texture.path).stem)
+    else:
+        player.skin_texture = texture
+        await write_batcher.save(player, update_fields=["skin_texture_id"])
+        event_bus.publish("player_skin_set", uuid=player.uuid, name=player.name,
+                          texture=Path(texture.path).stem, model=texture.model)
+
+
+@router.delete("/api/user/profile/{uuid}/{texture_type}")
+async def delete_texture(uuid: str, texture_type: str, request: Request):
+    player, error = await _authorized_player(request, uuid, texture_type)
+    if error is not None:
+        return error
+
+    # Only unassigns the texture; the file stays in the owner's library
+    if texture_type == "cape":
+        player.cape_texture = None
+        await write_batcher.save(player, update_fields=["cape_texture_id"])
+        event_bus.publish("player_cape_cleared", uuid=player.uuid, name=player.name)
+    else:
+        player.skin_texture = None
+        await write_batcher.save(player, update_fields=["skin_texture_id"])
+        event_bus.publish("player_skin_cleared", uuid=player.uuid, name=player.name)
+    return Response(status_code=204)
@@ -0,0 +1,92 @@
+# pyauthskin/textures.py
+import hashlib
+import io
+import os
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import DATA_DIR
+from .database import User, Texture
+from .skins_render import generate_avatar, generate_cape_preview
+from .sprites import update_sprite_sheet, avatar_path_for
+from .writes import write_batcher
+
+# Texture storage shared by the web manager and the Yggdrasil texture API.
+
+
+def png_size(contents: bytes) -> Optional[tuple]:
+    """Returns (width, height) if `contents` is a valid PNG, else None."""
+    try:
+        from PIL import Image
+        img = Image.open(io.BytesIO(contents))
+        size = img.size  # Read from the header; verify() invalidates the image
+        img.verify()  # Verify it's a valid image
+        if img.format != "PNG":
+            raise ValueError("Not PNG")
+        return size
+    except Exception:
+        return None
+
+def is_valid_cape_size(width: int, height: int) -> bool:
+    # 64x32 and its HD multiples (2:1), or the legacy 22x17 layout
+    if (width, height) == (22, 17):
+        return True
+    return width == height * 2 and width % 64 == 0 and width <= 1024
+
+def is_valid_skin_size(width: int, height: int) -> bool:
+    # 64x64 / legacy 64x32 and their HD multiples
+    return width % 64 == 0 and width <= 1024 and height in (width, width // 2)
+
+def _write_file(path, contents: bytes) -> None:
+    # Write under a temporary name so readers never see a partial file
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(contents)
+    os.replace(tmp, path)
+
+async def store_texture(user: User, contents: bytes, size: tuple, texture_type: str,
+                        display_name: str, model: str = "classic") -> Texture:
+    """Shared storage path for skins and capes.
+
+    Files are content-addressed (named by hash) and shared between Texture
+    records; the derived image (skin avatar / cape preview) is rendered once
+    per file and added to the uploader's sprite sheet.
+    """
+    file_hash = hashlib.sha256(contents).hexdigest()[:8]
+
+    # Use absolute paths from DATA_DIR for file operations
+    skins_dir = DATA_DIR / "skins"
+    skins_dir.mkdir(parents=True, exist_ok=True)
+    texture_path = skins_dir / f"{file_hash}.png"
+    derived_path = avatar_path_for(str(texture_path), texture_type)
+
+    # Only write the file if it doesn't already exist on disk.
+    # Multiple Texture DB records may point to the same physical file.
+    if not texture_path.exists():
+        await run_in_threadpool(_write_file, texture_path, contents)
+
+    width, height = size
+
+    # Always create a Texture DB record for the uploader using the base
+    # file_hash (do not append a suffix). The DB no longer enforces
+    # uniqueness on the hash field so multiple users can have entries
+    # pointing to the same physical file.
+    texture = await write_batcher.create(
+        Texture,
+        hash=file_hash,
+        path=str(texture_path),
+        uploader=user,
+        width=width,
+        height=height,
+        display_name=display_name,
+        model=model,  # Save the model
+        type=texture_type
+    )
+
+    # Generate the derived image only if it doesn't exist yet
+    if not derived_path.exists():
+        render = generate_cape_preview if texture_type == "cape" else generate_avatar
+        await run_in_threadpool(render, texture_path, derived_path, width=width, height=height)
+    await update_sprite_sheet(user, added=[(texture.id, derived_path)])
+    return texture
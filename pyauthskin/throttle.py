@@ -0,0 +1,121 @@
+# pyauthskin/throttle.py
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import (LOGIN_THROTTLE_MAX_ENTRIES, LOGIN_THROTTLE_USER_BURST, LOGIN_THROTTLE_USER_REFILL_SECONDS,
+                    LOGIN_THROTTLE_IP_BURST, LOGIN_THROTTLE_IP_REFILL_SECONDS,
+                    LOGIN_THROTTLE_BASE_LOCKOUT_SECONDS, LOGIN_THROTTLE_MAX_LOCKOUT_SECONDS)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "failures", "lockouts", "locked_until")
+
+    def __init__(self, burst: int, now: float):
+        self.tokens = float(burst)
+        self.updated = now
+        self.failures = 0
+        self.lockouts = 0
+        self.locked_until = 0.0
+
+
+class LoginThrottle:
+    """Failed-login token buckets keyed by username and by client IP.
+
+    The check runs before any password hash is verified, so a rejected
+    attempt only costs a dict lookup. Buckets only drain on failures; once a
+    bucket is empty the key is locked out for an exponentially growing
+    period. Both tables are LRU-bounded so memory stays flat under a flood
+    of random usernames or addresses.
+    """
+
+    def __init__(self, max_entries: int = LOGIN_THROTTLE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._limits = {
+            "user": (LOGIN_THROTTLE_USER_BURST, LOGIN_THROTTLE_USER_REFILL_SECONDS),
+            "ip": (LOGIN_THROTTLE_IP_BURST, LOGIN_THROTTLE_IP_REFILL_SECONDS),
+        }
+        self._buckets = {kind: OrderedDict() for kind in self._limits}
+        self.stats = {"rejected": 0, "failures": 0, "evictions": 0}
+
+    def _get(self, kind: str, key: str, now: float, create: bool) -> Optional[_Bucket]:
+        table = self._buckets[kind]
+        bucket = table.get(key)
+        if bucket is None:
+            if not create:
+                return None
+            bucket = table[key] = _Bucket(self._limits[kind][0], now)
+            if len(table) > self.max_entries:
+                table.popitem(last=False)
+                self.stats["evictions"] += 1
+        else:
+            table.move_to_end(key)
+            burst, refill_seconds = self._limits[kind]
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) / refill_seconds)
+            bucket.updated = now
+            if bucket.tokens >= burst:
+                # A fully refilled bucket means the key has behaved; start
+                # the backoff over from the base lockout.
+                bucket.lockouts = 0
+        return bucket
+
+    def check(self, username: str, ip: Optional[str]) -> float:
+        """Returns 0 if a login attempt may proceed, else seconds to wait."""
+        now = time.monotonic()
+        wait = 0.0
+        for kind, key in (("user", username.lower()), ("ip", ip)):
+            if not key:
+                continue
+            bucket = self._get(kind, key, now, create=False)
+            if bucket and bucket.locked_until > now:
+                wait = max(wait, bucket.locked_until - now)
+        if wait:
+            self.stats["rejected"] += 1
+        return wait
+
+    def record_failure(self, username: str, ip: Optional[str]) -> None:
+        now = time.monotonic()
+        self.stats["failures"] += 1
+        for kind, key in (("user", username.lower()), ("ip", ip)):
+            if not key:
+                continue
+            bucket = self._get(kind, key, now, create=True)
+            bucket.failures += 1
+            bucket.tokens = max(0.0, bucket.tokens - 1)
+            if bucket.tokens < 1:
+                lockout = min(LOGIN_THROTTLE_MAX_LOCKOUT_SECONDS,
+                              LOGIN_THROTTLE_BASE_LOCKOUT_SECONDS * (2 ** bucket.lockouts))
+                bucket.locked_until = now + lockout
+                bucket.lockouts += 1
+
+    def record_success(self, username: str) -> None:
+        # Only the username is forgiven; an IP stuffing many accounts should
+        # not get its budget back because one of the guesses was right.
+        self._buckets["user"].pop(username.lower(), None)
+
+    def reset(self, kind: str, key: str) -> bool:
+        return self._buckets[kind].pop(key, None) is not None
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        entries = []
+        for kind, table in self._buckets.items():
+            for key, bucket in table.items():
+                entries.append({
+                    "kind": kind,
+                    "key": key,
+                    "tokens": round(bucket.tokens, 2),
+                    "failures": bucket.failures,
+                    "lockouts": bucket.lockouts,
+                    "locked_for": round(max(0.0, bucket.locked_until - now), 1),
+                })
+        return {
+            "stats": dict(self.stats),
+            "sizes": {kind: len(table) for kind, table in self._buckets.items()},
+            "max_entries": self.max_entries,
+            "entries": entries,
+        }
+
+
+# Shared instance used by both the Yggdrasil and web login routes
+login_throttle = LoginThrottle()
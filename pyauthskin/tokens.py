@@ -0,0 +1,29 @@
+# pyauthskin/tokens.py
+import uuid
+from typing import Optional
+
+from config import MAX_TOKENS_PER_USER
+from .database import Token, User
+
+
+async def issue_token(user: User, client_token: Optional[str] = None) -> Token:
+    """Creates a new access token for `user`, revoking the oldest beyond the limit."""
+    token = await Token.create(
+        access_token=uuid.uuid4().hex,
+        client_token=client_token or uuid.uuid4().hex,
+        user=user,
+    )
+    stale = await Token.filter(user=user).order_by("-id").offset(MAX_TOKENS_PER_USER).values_list("id", flat=True)
+    if stale:
+        await Token.filter(id__in=list(stale)).delete()
+    return token
+
+
+async def get_token(access_token: Optional[str], client_token: Optional[str] = None) -> Optional[Token]:
+    """Returns the token if it exists (and matches `client_token` when given)."""
+    if not access_token:
+        return None
+    token = await Token.filter(access_token=access_token).first()
+    if token is None or (client_token and token.client_token != client_token):
+        return None
+    return token
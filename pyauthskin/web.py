@@ -1,28 +1,36 @@
 # pyauthskin/web.py
 
-import hashlib
 import re
 import uuid
-import io
 from pathlib import Path
 from typing import Optional
 
 from fastapi import (APIRouter, Depends, File, Form, Request,
                      Response, UploadFile, HTTPException)
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from tortoise.exceptions import DoesNotExist, IntegrityError
 
-from config import BASE_DIR, DATA_DIR
+from config import (BASE_DIR, DATA_DIR, MANAGER_API_PAGE_SIZE, MANAGER_API_MAX_PAGE_SIZE,
+                    SPRITE_THUMB_SIZE, SPRITE_COLUMNS)
 from .database import User, Player, Texture
 from .security import pwd_context
-from .skins_render import generate_avatar
+from .textures import png_size, is_valid_cape_size, store_texture
+from .sprites import (get_sprite_manifest, sprite_position, sprite_style,
+                      sheet_path_for, avatar_path_for, update_sprite_sheet)
+from .assets import asset_url
+from .events import event_bus
+from .throttle import login_throttle
+from .loadshed import shed, PRIORITY_LOW
+from .writes import write_batcher
 
 # Create a new router for the web interface
 router = APIRouter()
 
 # Templates are needed for the web routes
 templates = Jinja2Templates(directory=BASE_DIR / "site")
+templates.env.globals["asset_url"] = asset_url
 
 # --- Dependency for getting current user from session cookie ---
 async def get_current_user(request: Request) -> Optional[User]:
@@ -36,26 +44,35 @@ async def get_current_user(request: Request) -> Optional[User]:
 
 # --- Web UI Endpoints ---
 
-@router.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse, dependencies=[shed("web", PRIORITY_LOW)])
 async def homepage(request: Request, user: User = Depends(get_current_user)):
     return templates.TemplateResponse("index.html", {"request": request, "user": user})
 
-@router.get("/login", response_class=HTMLResponse)
+@router.get("/login", response_class=HTMLResponse, dependencies=[shed("web", PRIORITY_LOW)])
 async def login_page(request: Request, user: User = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/manager")
     return templates.TemplateResponse("login.html", {"request": request})
 
-@router.post("/login")
+@router.post("/login", dependencies=[shed("login")])
 async def login_form(request: Request, response: Response, username: str = Form(...), password: str = Form(...)):
+    # Reject throttled usernames/IPs before paying for an Argon2 verify
+    client_ip = request.client.host if request.client else None
+    retry_after = login_throttle.check(username, client_ip)
+    if retry_after:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Too many failed attempts, please try again later"},
+                                          status_code=429, headers={"Retry-After": str(int(retry_after) + 1)})
     try:
         user = await User.get(username=username)
-        if not pwd_context.verify(password, user.password):
+        if not await run_in_threadpool(pwd_context.verify, password, user.password):
+            login_throttle.record_failure(username, client_ip)
             return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password"}, status_code=400)
         
+        login_throttle.record_success(username)
         request.session["user_id"] = user.id
         return RedirectResponse(url="/manager", status_code=303)
     except DoesNotExist:
+        login_throttle.record_failure(username, client_ip)
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password"}, status_code=400)
 
 @router.get("/logout")
@@ -63,13 +80,13 @@ async def logout(request: Request):
     request.session.clear()
     return RedirectResponse(url="/login", status_code=303)
 
-@router.get("/register", response_class=HTMLResponse)
+@router.get("/register", response_class=HTMLResponse, dependencies=[shed("web", PRIORITY_LOW)])
 async def register_page(request: Request, user: User = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/manager")
     return templates.TemplateResponse("register.html", {"request": request})
 
-@router.post("/register")
+@router.post("/register", dependencies=[shed("login")])
 async def register(request: Request, username: str = Form(...), password: str = Form(...)):
     # Username validation
     if len(username) < 3 or len(username) > 20:
@@ -83,112 +100,198 @@ async def register(request: Request, username: str = Form(...), password: str =
     if not re.search(r"[a-z]", password) or not re.search(r"[A-Z]", password):
         return templates.TemplateResponse("register.html", {"request": request, "error": "Password must contain both uppercase and lowercase letters"}, status_code=400)
 
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await run_in_threadpool(pwd_context.hash, password)
+    player_uuid = str(uuid.uuid4()).replace('-', '')
+
+    async def create_account(conn):
+        # Account and its first player are written together
+        user = await User.create(username=username, password=hashed_password, using_db=conn)
+        player = await Player.create(user=user, name=username, uuid=player_uuid, using_db=conn)
+        return user, player
+
     try:
-        user = await User.create(username=username, password=hashed_password)
-        player_uuid = str(uuid.uuid4()).replace('-', '')
-        player = await Player.create(user=user, name=username, uuid=player_uuid)
+        user, player = await write_batcher.submit(create_account)
+        event_bus.publish("player_created", uuid=player.uuid, name=player.name)
         
         request.session["user_id"] = user.id
         return RedirectResponse(url="/manager", status_code=303)
     except IntegrityError:
         return templates.TemplateResponse("register.html", {"request": request, "error": "Username already exists"}, status_code=400)
 
-@router.get("/manager", response_class=HTMLResponse)
-async def manager(request: Request, user: User = Depends(get_current_user)):
+@router.get("/manager", response_class=HTMLResponse, dependencies=[shed("web", PRIORITY_LOW)])
+async def manager(request: Request, skins_after: Optional[int] = None, capes_after: Optional[int] = None,
+                  players_after: Optional[int] = None, user: User = Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login")
     
-    # Fetch user skins and players
-    skins = await Texture.filter(uploader=user)
-    # Compute avatar filename to use in templates. We store the physical
-    # path in Texture.path, but Texture.hash may include a DB-unique suffix
-    # so we derive avatar filename from the actual file stem.
-    for s in skins:
+    # One page each of skins, capes and players; the page links carry each
+    # list's keyset cursor
+    skins, next_skins = await _texture_page(user, "skin", skins_after, MANAGER_API_PAGE_SIZE)
+    capes, next_capes = await _texture_page(user, "cape", capes_after, MANAGER_API_PAGE_SIZE)
+    players, next_players = await _player_page(user, players_after, MANAGER_API_PAGE_SIZE)
+
+    # The assignment dropdowns offer the textures shown on this page; a
+    # player's current texture from another page is fetched by id so its
+    # dropdown still shows it
+    shown = {t.id for t in skins + capes}
+    missing = ({p.skin_texture_id for p in players} | {p.cape_texture_id for p in players}) - shown - {None}
+    assigned = {t.id: t for t in await Texture.filter(id__in=missing, uploader=user)} if missing else {}
+
+    # Compute avatar (or cape preview) filename to use in templates. We store
+    # the physical path in Texture.path, but Texture.hash may include a
+    # DB-unique suffix so we derive the filename from the actual file stem.
+    for s in skins + capes:
         try:
-            p = Path(s.path)
-            s.avatar_filename = f"{p.stem}_avatar.png"
+            s.avatar_filename = avatar_path_for(s.path, s.type).name
         except Exception:
             # Fall back to using the DB hash if path is missing
             s.avatar_filename = f"{s.hash}_avatar.png"
-    players = await Player.filter(user=user).prefetch_related('skin_texture')
-    return templates.TemplateResponse("manager.html", {"request": request, "user": user, "skins": skins, "players": players})
-
-
-@router.post("/manager/upload_skin")
-async def upload_skin(
-    request: Request,
-    skin_file: UploadFile = File(...),
-    display_name: str = Form(...),
-    model: str = Form("classic"),  # Add model parameter
-    user: User = Depends(get_current_user)
-):
-    
+    # Thumbnails come from the user's sprite sheet so the page needs a single
+    # image fetch; skins missing from the sheet fall back to their own avatar.
+    sprites = await get_sprite_manifest(user)
+    for s in skins + capes:
+        s.sprite_style = sprite_style(sprites, s.id)
+    sprite_url = f"/manager/sprites.png?v={sprites['version']}"
+    return templates.TemplateResponse("manager.html", {
+        "request": request, "user": user, "skins": skins, "capes": capes, "players": players,
+        "assigned": assigned, "sprite_url": sprite_url,
+        "next_skins": next_skins, "next_capes": next_capes, "next_players": next_players,
+    })
+
+def _page_args(after: Optional[int], limit: Optional[int]):
+    limit = MANAGER_API_PAGE_SIZE if limit is None else max(1, min(limit, MANAGER_API_MAX_PAGE_SIZE))
+    return after or 0, limit
+
+# Keyset pagination: seek past the last id instead of OFFSET, fetching one
+# extra row to know whether another page exists. Served by the
+# (uploader_id, type, id) and (user_id, id) indexes from ensure_indexes().
+async def _texture_page(user: User, texture_type: str, after: Optional[int], limit: int):
+    rows = await Texture.filter(uploader=user, type=texture_type, id__gt=after or 0).order_by("id").limit(limit + 1)
+    return rows[:limit], (rows[limit - 1].id if len(rows) > limit else None)
+
+async def _player_page(user: User, after: Optional[int], limit: int):
+    rows = await Player.filter(user=user, id__gt=after or 0).order_by("id").limit(limit + 1)
+    return rows[:limit], (rows[limit - 1].id if len(rows) > limit else None)
+
+@router.get("/manager/api/skins")
+async def manager_api_skins(after: Optional[int] = None, limit: Optional[int] = None, type: str = "skin",
+                            user: User = Depends(get_current_user)):
+    """A page of the user's skins (or capes with type=cape), ordered by id. Pass `next_after` back as `after` for the next page."""
     if not user:
-        return RedirectResponse(url="/login", status_code=403)
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    after, limit = _page_args(after, limit)
+    rows, next_after = await _texture_page(user, type, after, limit)
+    sprites = await get_sprite_manifest(user)
+    items = []
+    for t in rows:
+        stem = Path(t.path).stem
+        items.append({
+            "id": t.id,
+            "display_name": t.display_name,
+            "model": t.model,
+            "width": t.width,
+            "height": t.height,
+            "url": f"/skins/{stem}.png",
+            "type": t.type,
+            "avatar_url": f"/skins/{avatar_path_for(t.path, t.type).name}",
+            "sprite": sprite_position(sprites, t.id),
+        })
+    return {
+        "items": items,
+        "next_after": next_after,
+        "sprite_sheet": {
+            "url": f"/manager/sprites.png?v={sprites['version']}",
+            "thumb_size": SPRITE_THUMB_SIZE,
+            "columns": SPRITE_COLUMNS,
+        },
+    }
+
+@router.get("/manager/api/players")
+async def manager_api_players(after: Optional[int] = None, limit: Optional[int] = None, user: User = Depends(get_current_user)):
+    """A page of the user's players, ordered by id. Pass `next_after` back as `after` for the next page."""
+    if not user:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    after, limit = _page_args(after, limit)
+    rows, next_after = await _player_page(user, after, limit)
+    items = [{"id": p.id, "name": p.name, "uuid": p.uuid, "skin_id": p.skin_texture_id,
+              "cape_id": p.cape_texture_id} for p in rows]
+    return {"items": items, "next_after": next_after}
+
+@router.get("/manager/sprites.png")
+async def manager_sprites(v: Optional[int] = None, user: User = Depends(get_current_user)):
+    """The current user's avatar sprite sheet."""
+    if not user:
+        return Response(status_code=401)
+    sprites = await get_sprite_manifest(user)
+    # Versioned URLs never change content, so they can be cached for good
+    if v == sprites["version"]:
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        cache_control = "private, no-cache"
+    return FileResponse(sheet_path_for(user.id), media_type="image/png",
+                        headers={"Cache-Control": cache_control})
+
 
+async def _read_png_upload(request: Request, user: User, upload: UploadFile, display_name: str):
+    """Reads and validates an uploaded PNG; returns (contents, size) or an error response."""
     # Display name validation
     if len(display_name) < 1 or len(display_name) > 50:
         return templates.TemplateResponse("manager.html", {"request": request, "user": user, "error": "Display name must be between 1 and 50 characters"}, status_code=400)
 
     # File size limit: 1MB
-    contents = await skin_file.read()
+    contents = await upload.read()
     if len(contents) > 1024 * 1024:
         return templates.TemplateResponse("manager.html", {"request": request, "user": user, "error": "File size must be less than 1MB"}, status_code=400)
 
     # File type validation
-    if not skin_file.content_type or not skin_file.content_type.startswith("image/png"):
+    if not upload.content_type or not upload.content_type.startswith("image/png"):
         return templates.TemplateResponse("manager.html", {"request": request, "user": user, "error": "Only PNG files are allowed"}, status_code=400)
     
     # Validate PNG content
-    try:
-        from PIL import Image
-        img = Image.open(io.BytesIO(contents))
-        img.verify()  # Verify it's a valid image
-        if img.format != "PNG":
-            raise ValueError("Not PNG")
-    except Exception:
+    size = png_size(contents)
+    if size is None:
         return templates.TemplateResponse("manager.html", {"request": request, "user": user, "error": "Invalid PNG file"}, status_code=400)
+    return contents, size
 
-    file_hash = hashlib.sha256(contents).hexdigest()[:8]
-
-    # Use absolute paths from DATA_DIR for file operations
-    skins_dir = DATA_DIR / "skins"
-    skins_dir.mkdir(parents=True, exist_ok=True)
-    skin_path = skins_dir / f"{file_hash}.png"
-    avatar_path = skins_dir / f"{file_hash}_avatar.png"
-
-    # Only write the file if it doesn't already exist on disk.
-    # Multiple Texture DB records may point to the same physical file.
-    if not skin_path.exists():
-        with open(skin_path, "wb") as f:
-            f.write(contents)
-
-    # Get image dimensions using Pillow within this function's scope
-    from PIL import Image # Import Image here to avoid circular dependency if skins_render also imports main
-    with Image.open(skin_path) as img:
-        skin_width, skin_height = img.size
-
-    # Always create a Texture DB record for the uploader using the base
-    # file_hash (do not append a suffix). The DB no longer enforces
-    # uniqueness on the hash field so multiple users can have entries
-    # pointing to the same physical file.
-    db_hash = file_hash
-
-    texture = await Texture.create(
-        hash=db_hash,
-        path=str(skin_path),
-        uploader=user,
-        width=skin_width,
-        height=skin_height,
-        display_name=display_name,
-        model=model  # Save the model
-    )
-
-    # Generate avatar only if it doesn't exist yet
-    if not avatar_path.exists():
-        generate_avatar(skin_path, avatar_path, width=skin_width, height=skin_height)
+@router.post("/manager/upload_skin", dependencies=[shed("image", PRIORITY_LOW)])
+async def upload_skin(
+    request: Request,
+    skin_file: UploadFile = File(...),
+    display_name: str = Form(...),
+    model: str = Form("classic"),  # Add model parameter
+    user: User = Depends(get_current_user)
+):
+    
+    if not user:
+        return RedirectResponse(url="/login", status_code=403)
+
+    result = await _read_png_upload(request, user, skin_file, display_name)
+    if not isinstance(result, tuple):
+        return result
+    contents, size = result
+
+    await store_texture(user, contents, size, "skin", display_name, model)
+    return RedirectResponse(url="/manager", status_code=303)
+
+@router.post("/manager/upload_cape", dependencies=[shed("image", PRIORITY_LOW)])
+async def upload_cape(
+    request: Request,
+    cape_file: UploadFile = File(...),
+    display_name: str = Form(...),
+    user: User = Depends(get_current_user)
+):
+    if not user:
+        return RedirectResponse(url="/login", status_code=403)
+
+    result = await _read_png_upload(request, user, cape_file, display_name)
+    if not isinstance(result, tuple):
+        return result
+    contents, size = result
+
+    if not is_valid_cape_size(*size):
+        return templates.TemplateResponse("manager.html", {"request": request, "user": user, "error": "Cape must be 64x32 (or a 2:1 multiple up to 1024x512) or 22x17"}, status_code=400)
 
+    await store_texture(user, contents, size, "cape", display_name)
     return RedirectResponse(url="/manager", status_code=303)
 
 @router.post("/manager/set_skin_for_player/{player_id}")
@@ -200,17 +303,47 @@ async def set_skin_for_player(player_id: int, request: Request, skin_id: Optiona
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
 
+    texture = None
     if skin_id is None or skin_id == "":
         player.skin_texture = None
     else:
-        texture = await Texture.filter(id=int(skin_id), uploader=user).first()
+        texture = await Texture.filter(id=int(skin_id), uploader=user, type="skin").first()
         if not texture:
             raise HTTPException(status_code=404, detail="Skin not found")
         player.skin_texture = texture
 
-    await player.save()
+    await write_batcher.save(player, update_fields=["skin_texture_id"])
+    if texture is None:
+        event_bus.publish("player_skin_cleared", uuid=player.uuid, name=player.name)
+    else:
+        event_bus.publish("player_skin_set", uuid=player.uuid, name=player.name,
+                          texture=Path(texture.path).stem, model=texture.model)
     return RedirectResponse(url="/manager", status_code=303)
 
+@router.post("/manager/set_cape_for_player/{player_id}")
+async def set_cape_for_player(player_id: int, request: Request, cape_id: Optional[str] = Form(None), user: User = Depends(get_current_user)):
+    if not user:
+        return RedirectResponse(url="/login", status_code=403)
+
+    player = await Player.filter(id=player_id, user=user).first()
+    if not player:
+        raise HTTPException(status_code=404, detail="Player not found")
+
+    texture = None
+    if cape_id is None or cape_id == "":
+        player.cape_texture = None
+    else:
+        texture = await Texture.filter(id=int(cape_id), uploader=user, type="cape").first()
+        if not texture:
+            raise HTTPException(status_code=404, detail="Cape not found")
+        player.cape_texture = texture
+
+    await write_batcher.save(player, update_fields=["cape_texture_id"])
+    if texture is None:
+        event_bus.publish("player_cape_cleared", uuid=player.uuid, name=player.name)
+    else:
+        event_bus.publish("player_cape_set", uuid=player.uuid, name=player.name,
+                          texture=Path(texture.path).stem)
     return RedirectResponse(url="/manager", status_code=303)
 
 @router.post("/manager/delete_skin/{texture_id}")
@@ -222,8 +355,13 @@ async def delete_skin(texture_id: int, request: Request, user: User = Depends(ge
     if not texture:
         return Response(status_code=404)
 
-    # Unset this skin from any players using it by updating the foreign key ID to null
-    await Player.filter(skin_texture_id=texture.id).update(skin_texture_id=None)
+    # Unset this texture from any players using it by updating the foreign key ID to null
+    if texture.type == "cape":
+        affected_players = await Player.filter(cape_texture_id=texture.id).values("uuid", "name")
+        await Player.filter(cape_texture_id=texture.id).update(cape_texture_id=None)
+    else:
+        affected_players = await Player.filter(skin_texture_id=texture.id).values("uuid", "name")
+        await Player.filter(skin_texture_id=texture.id).update(skin_texture_id=None)
 
     # Delete the skin file only if no other Texture references the same file path
     skin_path = None
@@ -232,7 +370,7 @@ async def delete_skin(texture_id: int, request: Request, user: User = Depends(ge
     except Exception:
         skin_path = DATA_DIR / "skins" / f"{texture.hash}.png"
 
-    avatar_path = skin_path.parent / f"{skin_path.stem}_avatar.png"
+    derived_paths = [avatar_path_for(str(skin_path), "skin"), avatar_path_for(str(skin_path), "cape")]
 
     # Check if other textures reference this same file
     other_refs = await Texture.filter(path=str(skin_path)).exclude(id=texture.id).count()
@@ -240,10 +378,13 @@ async def delete_skin(texture_id: int, request: Request, user: User = Depends(ge
     # Delete the physical file only when this is the last reference
     if other_refs == 0 and skin_path.exists():
         skin_path.unlink()
-        if avatar_path.exists():
-            avatar_path.unlink()
+        for derived_path in derived_paths:
+            if derived_path.exists():
+                derived_path.unlink()
 
     await texture.delete()
+    await update_sprite_sheet(user, removed=[texture_id])
+    event_bus.publish("texture_deleted", texture=skin_path.stem, type=texture.type, players=affected_players)
     return RedirectResponse(url="/manager", status_code=303)
 
 @router.post("/manager/create_player")
@@ -265,7 +406,8 @@ async def create_player(request: Request, name: str = Form(...), user: User = De
     player_uuid = str(uuid.uuid4()).replace('-', '')
 
     # Create the player
-    await Player.create(user=user, name=name, uuid=player_uuid)
+    player = await write_batcher.create(Player, user=user, name=name, uuid=player_uuid)
+    event_bus.publish("player_created", uuid=player.uuid, name=player.name)
     return RedirectResponse(url="/manager", status_code=303)
 
 @router.post("/manager/delete_player/{player_id}")
@@ -278,4 +420,5 @@ async def delete_player(player_id: int, request: Request, user: User = Depends(g
         raise HTTPException(status_code=404, detail="Player not found")
 
     await player.delete()
+    event_bus.publish("player_deleted", uuid=player.uuid, name=player.name)
     return RedirectResponse(url="/manager", status_code=303)
@@ -0,0 +1,195 @@
+# pyauthskin/writes.py
+import asyncio
+
+from tortoise import timezone
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+from config import WRITE_BATCH_WINDOW_MS, WRITE_BATCH_MAX, USAGE_FLUSH_SECONDS
+from .database import Player
+
+
+class WriteBatcher:
+    """Coalesces small database writes into shared transactions.
+
+    SQLite has a single writer and pays for a commit per transaction, so a
+    burst of web-UI mutations (everyone changing skins at once) queues up on
+    the write lock. Writes submitted within WRITE_BATCH_WINDOW_MS of each
+    other run in one transaction instead, and each caller's await returns
+    once that transaction has committed.
+
+    A write is a coroutine function taking the transaction connection; every
+    query in it must use that connection (`using_db=conn`), or it waits on
+    the lock the batch itself holds.
+    """
+
+    def __init__(self, window_ms: float = WRITE_BATCH_WINDOW_MS, batch_max: int = WRITE_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.batch_max = batch_max
+        self._pending = []
+        self._flush_handle = None
+        self._tasks = set()
+        self._lock = asyncio.Lock()
+        self.stats = {"writes": 0, "transactions": 0, "replayed": 0, "errors": 0}
+
+    async def submit(self, write):
+        """Runs `write(conn)` in the next batch and returns its result after commit."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((write, fut))
+        if len(self._pending) >= self.batch_max:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await fut
+
+    async def create(self, model_cls, /, **kwargs):
+        """Batched `model_cls.create(**kwargs)`."""
+        return await self.submit(lambda conn: model_cls.create(using_db=conn, **kwargs))
+
+    async def save(self, instance, update_fields=None):
+        """Batched `instance.save()`."""
+        return await self.submit(lambda conn: instance.save(using_db=conn, update_fields=update_fields))
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._commit(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch) -> list:
+        async with in_transaction() as conn:
+            return [await write(conn) for write, _ in batch]
+
+    async def _commit(self, batch) -> None:
+        # Batches commit one after another, in submission order
+        async with self._lock:
+            try:
+                results = await self._run(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self.stats["errors"] += 1
+                    if not batch[0][1].done():
+                        batch[0][1].set_exception(e)
+                    return
+                # The whole batch rolled back; replay the writes one by one
+                # so a single failing write (e.g. a duplicate name) only
+                # fails its own caller
+                self.stats["replayed"] += 1
+                for item in batch:
+                    write, fut = item
+                    try:
+                        result = (await self._run([item]))[0]
+                    except Exception as item_error:
+                        self.stats["errors"] += 1
+                        if not fut.done():
+                            fut.set_exception(item_error)
+                        continue
+                    self.stats["transactions"] += 1
+                    self.stats["writes"] += 1
+                    if not fut.done():
+                        fut.set_result(result)
+                return
+            self.stats["transactions"] += 1
+            self.stats["writes"] += len(batch)
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    async def drain(self) -> None:
+        """Commits everything submitted so far."""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def snapshot(self) -> dict:
+        transactions = self.stats["transactions"] or 1
+        return {
+            "pending": len(self._pending),
+            "avg_batch_size": round(self.stats["writes"] / transactions, 2),
+            **self.stats,
+        }
+
+
+write_batcher = WriteBatcher()
+
+
+class UsageTracker:
+    """Per-player last-seen / last-join timestamps and join counts.
+
+    Recorded in memory on every join and hasJoined and written out every
+    USAGE_FLUSH_SECONDS as one batched write, so a busy server costs one
+    transaction per interval rather than one per join.
+    """
+
+    def __init__(self, flush_seconds: float = USAGE_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        # uuid -> [last_seen_at, last_join_at, joins since last flush]
+        self._pending = {}
+        self._task = None
+
+    def _entry(self, uuid: str) -> list:
+        entry = self._pending.get(uuid)
+        if entry is None:
+            entry = self._pending[uuid] = [None, None, 0]
+        return entry
+
+    def seen(self, uuid: str) -> None:
+        """A game server verified the player (hasJoined)."""
+        self._entry(uuid)[0] = timezone.now()
+
+    def joined(self, uuid: str) -> None:
+        """The player's client joined a server (join)."""
+        entry = self._entry(uuid)
+        entry[0] = entry[1] = timezone.now()
+        entry[2] += 1
+
+    async def flush(self) -> None:
+        entries, self._pending = self._pending, {}
+        if not entries:
+            return
+
+        async def write(conn):
+            for uuid, (seen_at, joined_at, joins) in entries.items():
+                fields = {"last_seen_at": seen_at}
+                if joined_at is not None:
+                    fields["last_join_at"] = joined_at
+                    fields["join_count"] = F("join_count") + joins
+                await Player.filter(uuid=uuid).using_db(conn).update(**fields)
+
+        try:
+            await write_batcher.submit(write)
+        except Exception as e:
+            print(f"Usage flush failed, will retry: {e}")
+            # Merge back, keeping anything recorded since the swap
+            for uuid, (seen_at, joined_at, joins) in entries.items():
+                entry = self._entry(uuid)
+                entry[0] = entry[0] or seen_at
+                entry[1] = entry[1] or joined_at
+                entry[2] += joins
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        return {"pending_players": len(self._pending), "flush_seconds": self.flush_seconds}
+
+
+usage_tracker = UsageTracker()